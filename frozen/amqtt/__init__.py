@@ -0,0 +1,148 @@
+# Minimal MQTT 3.1.1 publisher built on uasyncio streams, the async counterpart
+# to umqtt.simple for anything that runs inside the event loop
+#
+#   client = MQTTClient("board", "192.168.0.10", keepalive=60)
+#   await client.connect()
+#   await client.publish("cabin/telemetry", payload)
+#   await client.ping()
+#
+# Connect & every read/write are bounded by timeouts, and cancelling the calling
+# task closes the connection. QoS 0 publish only, no subscriptions.
+import uasyncio
+from urequests import dns_invalidate, resolve
+
+CONNECT_TIMEOUT_MS = 5000
+TIMEOUT_MS = 5000
+
+_CONNECT = 0x10
+_CONNACK = 0x20
+_PUBLISH = 0x30
+_PINGREQ = b"\xc0\x00"
+_PINGRESP = 0xD0
+_DISCONNECT = b"\xe0\x00"
+
+
+def _remaining_length(n):
+    out = bytearray()
+    while True:
+        byte = n & 0x7F
+        n >>= 7
+        if n:
+            byte |= 0x80
+        out.append(byte)
+        if not n:
+            return out
+
+
+def _string(s):
+    if isinstance(s, str):
+        s = s.encode()
+    return bytes((len(s) >> 8, len(s) & 0xFF)) + s
+
+
+class MQTTClient:
+
+    def __init__(self, client_id, server, port=1883, keepalive=0,
+                 connect_timeout_ms=CONNECT_TIMEOUT_MS, timeout_ms=TIMEOUT_MS):
+        self.client_id = client_id
+        self.server = server
+        self.port = port
+        self.keepalive = keepalive
+        self.connect_timeout_ms = connect_timeout_ms
+        self.timeout_ms = timeout_ms
+        self._reader = None
+        self._writer = None
+
+    def is_connected(self):
+        return self._writer is not None
+
+    async def connect(self, clean_session=True):
+        ip = resolve(self.server, self.port)[-1][0]
+        try:
+            self._reader, self._writer = await uasyncio.wait_for_ms(
+                uasyncio.open_connection(ip, self.port), self.connect_timeout_ms
+            )
+        except (OSError, uasyncio.TimeoutError):
+            dns_invalidate(self.server, self.port)
+            raise
+        try:
+            body = bytearray(b"\x00\x04MQTT\x04")
+            body.append(0x02 if clean_session else 0)
+            body += bytes((self.keepalive >> 8, self.keepalive & 0xFF))
+            body += _string(self.client_id)
+            await self._send(bytes((_CONNECT,)) + _remaining_length(len(body)) + body)
+            kind, reply = await self._read_packet()
+            if kind & 0xF0 != _CONNACK or len(reply) < 2:
+                raise OSError("Bad CONNACK")
+            if reply[1]:
+                raise OSError("Connection refused: %d" % reply[1])
+        except BaseException:
+            self._close()
+            raise
+
+    async def publish(self, topic, msg, retain=False):
+        topic = _string(topic)
+        header = bytearray((_PUBLISH | (1 if retain else 0),))
+        header += _remaining_length(len(topic) + len(msg))
+        await self._guard(self._send, header, topic, msg)
+
+    async def ping(self):
+        await self._guard(self._ping)
+
+    async def disconnect(self):
+        if self._writer is None:
+            return
+        try:
+            await self._send(_DISCONNECT)
+        except (OSError, uasyncio.TimeoutError):
+            pass
+        self._close()
+
+    async def _ping(self):
+        await self._send(_PINGREQ)
+        # Nothing is subscribed, but skip anything that isn't the response anyway
+        while True:
+            kind, _ = await self._read_packet()
+            if kind & 0xF0 == _PINGRESP:
+                return
+
+    async def _guard(self, fn, *args):
+        # Any failure (cancellation too) leaves the connection in an unknown state, drop it
+        if self._writer is None:
+            raise OSError("Not connected")
+        try:
+            return await fn(*args)
+        except BaseException:
+            self._close()
+            raise
+
+    async def _send(self, *pieces):
+        writer = self._writer
+        for piece in pieces:
+            writer.write(piece)
+        await uasyncio.wait_for_ms(writer.drain(), self.timeout_ms)
+
+    async def _read_exactly(self, n):
+        try:
+            return await uasyncio.wait_for_ms(self._reader.readexactly(n), self.timeout_ms)
+        except EOFError:
+            raise OSError("Connection closed")
+
+    async def _read_packet(self):
+        kind = (await self._read_exactly(1))[0]
+        length = 0
+        shift = 0
+        while True:
+            byte = (await self._read_exactly(1))[0]
+            length |= (byte & 0x7F) << shift
+            if not byte & 0x80:
+                break
+            shift += 7
+        body = await self._read_exactly(length) if length else b""
+        return kind, body
+
+    def _close(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = None
+        self._writer = None
@@ -0,0 +1,241 @@
+# Async counterpart to urequests, built on uasyncio streams
+#
+#   resp = await arequests.post(url, json={...}, read_timeout_ms=5000)
+#   data = await resp.json()
+#
+# Connect & each read are bounded by timeouts, and cancelling the calling task
+# closes the connection. Only plain http is supported.
+import uasyncio
+from urequests import dns_invalidate, resolve
+
+CONNECT_TIMEOUT_MS = 5000
+READ_TIMEOUT_MS = 10000
+# Piece size when streaming a file object as the request body
+CHUNK_SIZE = 1024
+
+
+class Response:
+
+    def __init__(self, reader, writer, read_timeout_ms, length=None, chunked=False):
+        self.raw = reader
+        self._writer = writer
+        self.encoding = "utf-8"
+        self._read_timeout_ms = read_timeout_ms
+        # Body bytes left to read, None when the server didn't send a Content-Length
+        self._length = length
+        self._chunked = chunked
+        self._chunk_left = 0
+        self._done = length == 0
+
+    def close(self):
+        if self._writer:
+            self._writer.close()
+            self._writer = None
+            self.raw = None
+
+    async def _wait(self, coro):
+        return await uasyncio.wait_for_ms(coro, self._read_timeout_ms)
+
+    async def read_some(self, n):
+        # Up to n bytes of (de-chunked) body, b"" at the end of the body
+        if self._done or not self.raw:
+            return b""
+        raw = self.raw
+        if self._chunked:
+            if not self._chunk_left:
+                size = int((await self._wait(raw.readline())).split(b";", 1)[0], 16)
+                if not size:
+                    # Skip any trailers
+                    while True:
+                        l = await self._wait(raw.readline())
+                        if not l or l == b"\r\n":
+                            break
+                    self._done = True
+                    return b""
+                self._chunk_left = size
+            data = await self._wait(raw.read(min(n, self._chunk_left)))
+            if not data:
+                raise OSError("Connection closed")
+            self._chunk_left -= len(data)
+            if not self._chunk_left:
+                # CRLF after the chunk data
+                await self._wait(raw.readline())
+            return data
+        if self._length is None:
+            data = await self._wait(raw.read(n))
+            if not data:
+                self._done = True
+            return data
+        data = await self._wait(raw.read(min(n, self._length)))
+        if not data:
+            raise OSError("Connection closed")
+        self._length -= len(data)
+        if not self._length:
+            self._done = True
+        return data
+
+    async def readinto(self, buf):
+        mv = memoryview(buf)
+        data = await self.read_some(len(mv))
+        n = len(data)
+        mv[:n] = data
+        return n
+
+    async def read(self):
+        try:
+            buf = bytearray()
+            while True:
+                data = await self.read_some(CHUNK_SIZE)
+                if not data:
+                    break
+                buf += data
+            return bytes(buf)
+        finally:
+            self.close()
+
+    async def text(self):
+        return str(await self.read(), self.encoding)
+
+    async def json(self):
+        import ujson
+        return ujson.loads(await self.read())
+
+
+async def request(method, url, data=None, json=None, headers={},
+                  connect_timeout_ms=CONNECT_TIMEOUT_MS, read_timeout_ms=READ_TIMEOUT_MS, buffer=None):
+    # `buffer` is an optional preallocated bytearray for streaming a file object body
+    if json is not None:
+        assert data is None
+        import ujson
+        data = ujson.dumps(json)
+    try:
+        proto, dummy, host, path = url.split("/", 3)
+    except ValueError:
+        proto, dummy, host = url.split("/", 2)
+        path = ""
+    if proto != "http:":
+        raise ValueError("Unsupported protocol: " + proto)
+    port = 80
+    if ":" in host:
+        host, port = host.split(":", 1)
+        port = int(port)
+
+    # Connect to the cached address, so open_connection's own getaddrinfo has nothing to look up
+    ip = resolve(host, port)[-1][0]
+    try:
+        reader, writer = await uasyncio.wait_for_ms(uasyncio.open_connection(ip, port), connect_timeout_ms)
+    except (OSError, uasyncio.TimeoutError):
+        dns_invalidate(host, port)
+        raise
+    try:
+        streamed = data is not None and not isinstance(data, (bytes, bytearray, memoryview, str))
+        # A streamed body with a Content-Length from the caller goes out as-is, otherwise chunked
+        chunked_body = streamed and "Content-Length" not in headers
+        h = bytearray(b"%s /%s HTTP/1.%d\r\n" % (method, path, 1 if chunked_body else 0))
+        if not "Host" in headers:
+            h += b"Host: %s\r\n" % host
+        for k in headers:
+            h += k
+            h += b": "
+            h += headers[k]
+            h += b"\r\n"
+        if json is not None:
+            h += b"Content-Type: application/json\r\n"
+        if chunked_body:
+            h += b"Transfer-Encoding: chunked\r\n"
+        elif data and not streamed:
+            h += b"Content-Length: %d\r\n" % len(data)
+        h += b"Connection: close\r\n\r\n"
+        writer.write(h)
+        if streamed:
+            await _send_stream(writer, data, chunked_body, buffer)
+        elif data:
+            writer.write(data)
+        await uasyncio.wait_for_ms(writer.drain(), read_timeout_ms)
+
+        l = await uasyncio.wait_for_ms(reader.readline(), read_timeout_ms)
+        l = l.split(None, 2)
+        if len(l) < 2:
+            # Empty or truncated, the server hung up on us
+            raise ValueError("Bad status line")
+        # ValueError if it's not a number either
+        status = int(l[1])
+        reason = ""
+        if len(l) > 2:
+            reason = l[2].rstrip()
+        resp_d = {}
+        length = None
+        chunked = False
+        while True:
+            l = await uasyncio.wait_for_ms(reader.readline(), read_timeout_ms)
+            if not l or l == b"\r\n":
+                break
+            k, v = l.decode().split(":", 1)
+            v = v.strip()
+            resp_d[k] = v
+            k = k.lower()
+            if k == "content-length":
+                length = int(v)
+            elif k == "transfer-encoding" and "chunked" in v.lower():
+                chunked = True
+    except BaseException:
+        # Includes CancelledError, so a cancelled request never leaks its socket
+        writer.close()
+        raise
+
+    if method == "HEAD" or status == 204 or status == 304:
+        length = 0
+    if chunked:
+        length = None
+    resp = Response(reader, writer, read_timeout_ms, length, chunked)
+    resp.status_code = status
+    resp.reason = reason
+    resp.headers = resp_d
+    return resp
+
+
+async def _send_stream(writer, data, chunked, buf=None):
+    if hasattr(data, "readinto"):
+        if buf is None:
+            buf = bytearray(CHUNK_SIZE)
+        mv = memoryview(buf)
+        while True:
+            n = data.readinto(buf)
+            if not n:
+                break
+            await _send_piece(writer, mv[:n], chunked)
+    else:
+        for piece in data:
+            if piece:
+                await _send_piece(writer, piece, chunked)
+    if chunked:
+        writer.write(b"0\r\n\r\n")
+
+
+async def _send_piece(writer, piece, chunked):
+    if chunked:
+        writer.write(b"%x\r\n" % len(piece))
+    writer.write(piece)
+    if chunked:
+        writer.write(b"\r\n")
+    # Drain every piece so at most one is buffered
+    await writer.drain()
+
+
+async def head(url, **kw):
+    return await request("HEAD", url, **kw)
+
+async def get(url, **kw):
+    return await request("GET", url, **kw)
+
+async def post(url, **kw):
+    return await request("POST", url, **kw)
+
+async def put(url, **kw):
+    return await request("PUT", url, **kw)
+
+async def patch(url, **kw):
+    return await request("PATCH", url, **kw)
+
+async def delete(url, **kw):
+    return await request("DELETE", url, **kw)
@@ -1,26 +1,198 @@
 import usocket
+import utime
+
+# Keep-alive pool, only for requests made with keep_alive=True:
+# (proto, host, port) -> [[socket, last_used_ms], ...]
+_pool = {}
+POOL_MAX_PER_HOST = 2
+POOL_IDLE_MS = 30000
+# Piece size when streaming a file object as a chunked request body
+CHUNK_SIZE = 1024
+
+# DNS cache: (host, port) -> [addrinfo or None, expires_ms]. A None entry is a
+# cached lookup failure, retried once DNS_NEGATIVE_TTL_MS has passed
+_dns = {}
+DNS_TTL_MS = 300000
+DNS_NEGATIVE_TTL_MS = 10000
+dns_stats = {
+    "hits": 0,
+    "misses": 0,
+    "failures": 0,
+    "lookup_ms": 0,
+    "max_lookup_ms": 0,
+}
+
+
+def _pool_evict(now=None):
+    # Close connections that have sat idle for longer than POOL_IDLE_MS
+    if now is None:
+        now = utime.ticks_ms()
+    for key in _pool:
+        conns = _pool[key]
+        i = 0
+        while i < len(conns):
+            if utime.ticks_diff(now, conns[i][1]) > POOL_IDLE_MS:
+                conns.pop(i)[0].close()
+            else:
+                i += 1
+
+
+def _pool_get(key):
+    _pool_evict()
+    conns = _pool.get(key)
+    if conns:
+        return conns.pop()[0]
+    return None
+
+
+def _pool_put(key, s):
+    conns = _pool.get(key)
+    if conns is None:
+        conns = _pool[key] = []
+    if len(conns) >= POOL_MAX_PER_HOST:
+        s.close()
+        return
+    conns.append([s, utime.ticks_ms()])
+
+
+def pool_clear():
+    for key in _pool:
+        for conn in _pool[key]:
+            conn[0].close()
+    _pool.clear()
+
+
+def resolve(host, port):
+    # getaddrinfo is a blocking network round-trip on the ESP32, so answers are cached for DNS_TTL_MS
+    key = (host, port)
+    now = utime.ticks_ms()
+    entry = _dns.get(key)
+    if entry is not None and utime.ticks_diff(entry[1], now) > 0:
+        dns_stats["hits"] += 1
+        if entry[0] is None:
+            raise OSError("DNS lookup failed (cached): " + host)
+        return entry[0]
+    dns_stats["misses"] += 1
+    try:
+        ai = usocket.getaddrinfo(host, port, 0, usocket.SOCK_STREAM)[0]
+    except (OSError, IndexError):
+        dns_stats["failures"] += 1
+        _dns[key] = [None, utime.ticks_add(now, DNS_NEGATIVE_TTL_MS)]
+        raise OSError("DNS lookup failed: " + host)
+    finally:
+        elapsed = utime.ticks_diff(utime.ticks_ms(), now)
+        dns_stats["lookup_ms"] += elapsed
+        if elapsed > dns_stats["max_lookup_ms"]:
+            dns_stats["max_lookup_ms"] = elapsed
+    _dns[key] = [ai, utime.ticks_add(now, DNS_TTL_MS)]
+    return ai
+
+
+def dns_invalidate(host=None, port=None):
+    # Drop one cached answer (e.g. after a connect to it failed), or all of them
+    if host is None:
+        _dns.clear()
+    else:
+        _dns.pop((host, port), None)
+
 
 class Response:
 
-    def __init__(self, f):
+    def __init__(self, f, pool_key=None, length=None, chunked=False):
         self.raw = f
         self.encoding = "utf-8"
         self._cached = None
+        # Set when the connection can go back to the pool once the body is read
+        self._pool_key = pool_key
+        # Body bytes left to read, None when the server didn't send a Content-Length
+        self._length = length
+        self._chunked = chunked
+        self._chunk_left = 0
+        self._done = length == 0
 
     def close(self):
+        self._release()
+        self._cached = None
+
+    def _release(self):
+        # Hand the socket back to the pool if the body was fully read, otherwise close it
         if self.raw:
-            self.raw.close()
+            if self._pool_key is not None and self._done:
+                _pool_put(self._pool_key, self.raw)
+            else:
+                self.raw.close()
             self.raw = None
-        self._cached = None
+
+    def readinto(self, buf):
+        # Read up to len(buf) bytes of (de-chunked) body into buf, returns 0 at the end of the body
+        if self._done or not self.raw:
+            return 0
+        mv = memoryview(buf)
+        raw = self.raw
+        if self._chunked:
+            if not self._chunk_left:
+                size = int(raw.readline().split(b";", 1)[0], 16)
+                if not size:
+                    # Skip any trailers
+                    while True:
+                        l = raw.readline()
+                        if not l or l == b"\r\n":
+                            break
+                    self._done = True
+                    return 0
+                self._chunk_left = size
+            n = raw.readinto(mv[:min(len(mv), self._chunk_left)])
+            if not n:
+                raise OSError("Connection closed")
+            self._chunk_left -= n
+            if not self._chunk_left:
+                # CRLF after the chunk data
+                raw.readline()
+            return n
+        if self._length is None:
+            n = raw.readinto(mv)
+            if not n:
+                self._done = True
+                return 0
+            return n
+        n = raw.readinto(mv[:min(len(mv), self._length)])
+        if not n:
+            raise OSError("Connection closed")
+        self._length -= n
+        if not self._length:
+            self._done = True
+        return n
+
+    def iter_content(self, chunk_size=1024):
+        # Yield the body in pieces of up to chunk_size bytes, without holding all of it in RAM
+        buf = bytearray(chunk_size)
+        mv = memoryview(buf)
+        try:
+            while True:
+                n = self.readinto(buf)
+                if not n:
+                    break
+                yield bytes(mv[:n])
+        finally:
+            self._release()
 
     @property
     def content(self):
         if self._cached is None:
             try:
-                self._cached = self.raw.read()
+                if self._length is None:
+                    buf = bytearray()
+                    for piece in self.iter_content():
+                        buf += piece
+                else:
+                    buf = bytearray(self._length)
+                    mv = memoryview(buf)
+                    got = 0
+                    while got < len(buf):
+                        got += self.readinto(mv[got:])
+                self._cached = bytes(buf)
             finally:
-                self.raw.close()
-                self.raw = None
+                self._release()
         return self._cached
 
     @property
@@ -32,8 +204,35 @@ class Response:
         return ujson.loads(self.content)
 
 
-def request(method, url, data=None, json=None, headers={}, stream=None, parse_headers=True):
+def _connect(proto, host, port):
+    ai = resolve(host, port)
+    s = usocket.socket(ai[0], ai[1], ai[2])
+    try:
+        s.connect(ai[-1])
+    except OSError:
+        s.close()
+        # The host may have moved, look it up again next time
+        dns_invalidate(host, port)
+        raise
+    try:
+        if proto == "https:":
+            import ussl
+            s = ussl.wrap_socket(s, server_hostname=host)
+    except OSError:
+        s.close()
+        raise
+    return s
+
+
+def request(method, url, data=None, json=None, headers={}, stream=None, parse_headers=True, keep_alive=False):
     redir_cnt = 1
+    if json is not None:
+        assert data is None
+        import ujson
+        data = ujson.dumps(json)
+    # Generators & file objects are sent with chunked transfer-encoding, a piece at a time.
+    # They can't be replayed, so they never go out on a pooled socket that might be stale
+    streamed = data is not None and not isinstance(data, (bytes, bytearray, memoryview, str))
     while True:
         try:
             proto, dummy, host, path = url.split("/", 3)
@@ -43,7 +242,6 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
         if proto == "http:":
             port = 80
         elif proto == "https:":
-            import ussl
             port = 443
         else:
             raise ValueError("Unsupported protocol: " + proto)
@@ -52,39 +250,34 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
             host, port = host.split(":", 1)
             port = int(port)
 
-        ai = usocket.getaddrinfo(host, port, 0, usocket.SOCK_STREAM)
-        ai = ai[0]
+        pool_key = (proto, host, port) if keep_alive else None
+        s = _pool_get(pool_key) if keep_alive and not streamed else None
+        reused = s is not None
+        if s is None:
+            s = _connect(proto, host, port)
 
         resp_d = None
         if parse_headers is not False:
             resp_d = {}
 
-        s = usocket.socket(ai[0], ai[1], ai[2])
+        length = None
+        chunked = False
+        reusable = keep_alive
         try:
-            s.connect(ai[-1])
-            if proto == "https:":
-                s = ussl.wrap_socket(s, server_hostname=host)
-            s.write(b"%s /%s HTTP/1.0\r\n" % (method, path))
-            if not "Host" in headers:
-                s.write(b"Host: %s\r\n" % host)
-            # Iterate over keys to avoid tuple alloc
-            for k in headers:
-                s.write(k)
-                s.write(b": ")
-                s.write(headers[k])
-                s.write(b"\r\n")
-            if json is not None:
-                assert data is None
-                import ujson
-                data = ujson.dumps(json)
-                s.write(b"Content-Type: application/json\r\n")
-            if data:
-                s.write(b"Content-Length: %d\r\n" % len(data))
-            s.write(b"Connection: close\r\n\r\n")
-            if data:
-                s.write(data)
-
-            l = s.readline()
+            try:
+                _send(s, method, host, path, headers, data, json is not None, keep_alive, streamed)
+                l = s.readline()
+                if not l:
+                    raise OSError("Connection closed")
+            except OSError:
+                if not reused:
+                    raise
+                # The server dropped an idle pooled connection, retry once on a fresh one
+                s.close()
+                s = _connect(proto, host, port)
+                reused = False
+                _send(s, method, host, path, headers, data, json is not None, keep_alive, streamed)
+                l = s.readline()
             #print(l)
             l = l.split(None, 2)
             status = int(l[1])
@@ -97,10 +290,12 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
                     break
                 #print(l)
 
-                if l.startswith(b"Transfer-Encoding:"):
-                    if b"chunked" in l:
-                        raise ValueError("Unsupported " + l)
-                elif l.startswith(b"Location:") and 300 <= status <= 399:
+                # Header names (& the values compared here) are case-insensitive, compare lowercased copies
+                lower = l.lower()
+                if lower.startswith(b"transfer-encoding:"):
+                    if b"chunked" in lower:
+                        chunked = True
+                elif lower.startswith(b"location:") and 300 <= status <= 399:
                     if not redir_cnt:
                         raise ValueError("Too many redirects")
                     redir_cnt -= 1
@@ -109,6 +304,11 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
                     status = 300
                     break
 
+                if lower.startswith(b"content-length:"):
+                    length = int(l[15:])
+                elif lower.startswith(b"connection:") and b"close" in lower:
+                    reusable = False
+
                 if parse_headers is False:
                     pass
                 elif parse_headers is True:
@@ -117,14 +317,19 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
                     resp_d[k] = v.strip()
                 else:
                     parse_headers(l, resp_d)
-        except OSError:
+        except (OSError, ValueError):
             s.close()
             raise
 
         if status != 300:
             break
+        s.close()
 
-    resp = Response(s)
+    if method == "HEAD" or status == 204 or status == 304:
+        length = 0
+    if chunked:
+        length = None
+    resp = Response(s, pool_key if reusable and (length is not None or chunked) else None, length, chunked)
     resp.status_code = status
     resp.reason = reason
     if resp_d is not None:
@@ -132,6 +337,66 @@ def request(method, url, data=None, json=None, headers={}, stream=None, parse_he
     return resp
 
 
+def _send(s, method, host, path, headers, data, is_json, keep_alive, streamed=False):
+    # Build the whole head & send it in one write, so small packets don't stall on Nagle/delayed ACK
+    # Chunked bodies need HTTP/1.1, even when the connection isn't kept alive
+    h = bytearray(b"%s /%s HTTP/1.%d\r\n" % (method, path, 1 if keep_alive or streamed else 0))
+    if not "Host" in headers:
+        h += b"Host: %s\r\n" % host
+    # Iterate over keys to avoid tuple alloc
+    for k in headers:
+        h += k
+        h += b": "
+        h += headers[k]
+        h += b"\r\n"
+    if is_json:
+        h += b"Content-Type: application/json\r\n"
+    if streamed:
+        h += b"Transfer-Encoding: chunked\r\n"
+    elif data:
+        h += b"Content-Length: %d\r\n" % len(data)
+    elif keep_alive:
+        # HTTP/1.1 servers need to know there's no body
+        h += b"Content-Length: 0\r\n"
+    if keep_alive:
+        h += b"Connection: keep-alive\r\n\r\n"
+    else:
+        h += b"Connection: close\r\n\r\n"
+    s.write(h)
+    if streamed:
+        _send_chunked(s, data)
+    elif data:
+        s.write(data)
+
+
+def _send_chunked(s, data):
+    if hasattr(data, "readinto"):
+        buf = bytearray(CHUNK_SIZE)
+        mv = memoryview(buf)
+        while True:
+            n = data.readinto(buf)
+            if not n:
+                break
+            _send_chunk(s, mv[:n])
+    elif hasattr(data, "read"):
+        while True:
+            piece = data.read(CHUNK_SIZE)
+            if not piece:
+                break
+            _send_chunk(s, piece)
+    else:
+        for piece in data:
+            if piece:
+                _send_chunk(s, piece)
+    s.write(b"0\r\n\r\n")
+
+
+def _send_chunk(s, piece):
+    s.write(b"%x\r\n" % len(piece))
+    s.write(piece)
+    s.write(b"\r\n")
+
+
 def head(url, **kw):
     return request("HEAD", url, **kw)
 
@@ -0,0 +1,121 @@
+"""
+Per-reading cost of the Qwiic calibration, before (linear scan, a scale() closure & float
+math on every reading) & after (components.proxy.calibration)
+# #########################
+# $ python3 scripts/bench_calibration.py
+# $ micropython scripts/bench_calibration.py  # Unix port, closer to the board
+# #########################
+Also checks the new integer results stay within 1mm of the old float ones, rounded.
+"""
+import gc
+import os
+import sys
+
+try:
+    from utime import ticks_us, ticks_diff
+except ImportError:
+    from time import perf_counter
+
+    def ticks_us():
+        return int(perf_counter() * 1000000)
+
+    def ticks_diff(end, start):
+        return end - start
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+from components.proxy.calibration import Calibration  # noqa: E402
+
+ROUNDS = 200000
+
+# Keep in step with src/components/proxy/qwiic.py
+VALUE_MM_MAPPING = (
+    (34524, 0),
+    (84468, 305),
+    (164566, 610),
+    (249584, 914),
+    (324421, 1219),
+    (432534, 1524),
+    (506467, 1829),
+    (596762, 2134)
+)
+
+
+def scale(from_min, from_max, to_min, to_max):
+    # utils.math_utils.scale
+    from_diff = from_max - from_min
+    to_diff = to_max - to_min
+
+    def _scale(n):
+        left = (n - from_min) * to_diff
+        return (left / from_diff) + to_min
+
+    return _scale
+
+
+def old_project_distance(measured):
+    last_pair = (0, 0)
+    for proxy, mm in VALUE_MM_MAPPING:
+        last_proxy, last_mm = last_pair
+        if last_proxy <= measured <= proxy:
+            scale_value = scale(last_proxy, proxy, last_mm, mm)
+            return scale_value(measured)
+        last_pair = (proxy, mm)
+    return 0
+
+
+def readings():
+    # Spread over the whole table, plus a few past either end
+    low = VALUE_MM_MAPPING[0][0] - 10000
+    high = VALUE_MM_MAPPING[-1][0] + 10000
+    step = (high - low) // 97
+    return [low + i * step for i in range(98)]
+
+
+def allocated_per_reading(fn, values):
+    # MicroPython only: heap bytes per reading, each one is garbage the board has to collect
+    if not hasattr(gc, 'mem_alloc'):
+        return None
+    gc.collect()
+    gc.disable()
+    start = gc.mem_alloc()
+    for value in values:
+        fn(value)
+    allocated = gc.mem_alloc() - start
+    gc.enable()
+    return allocated / len(values)
+
+
+def bench(name, fn, values):
+    start = ticks_us()
+    for _ in range(ROUNDS // len(values)):
+        for value in values:
+            fn(value)
+    elapsed = ticks_diff(ticks_us(), start)
+    count = (ROUNDS // len(values)) * len(values)
+    per_reading = elapsed / count
+    allocated = allocated_per_reading(fn, values)
+    if allocated is None:
+        print('{:<8} {:8.2f} us/reading'.format(name, per_reading))
+    else:
+        print('{:<8} {:8.2f} us/reading {:6.1f} bytes/reading'.format(name, per_reading, allocated))
+    return per_reading
+
+
+def main():
+    values = readings()
+    calibration = Calibration(VALUE_MM_MAPPING)
+    worst = 0
+    first_raw = VALUE_MM_MAPPING[0][0]
+    last_raw = VALUE_MM_MAPPING[-1][0]
+    for value in values:
+        if first_raw <= value <= last_raw:
+            worst = max(worst, abs(calibration.convert(value) - round(old_project_distance(value))))
+    print('max difference inside the table: {} mm'.format(worst))
+    before = bench('before', old_project_distance, values)
+    after = bench('after', calibration.convert, values)
+    print('speedup: {:.1f}x'.format(before / after))
+    return 0 if worst <= 1 else 1
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,41 @@
+"""
+Requests/sec through frozen/urequests, pooled keep-alive vs. a new connection per request,
+and with vs. without the DNS cache
+# #########################
+# Start the stand-in server, then run this with the MicroPython unix port:
+# $ python3 scripts/http_test_server.py 8000 &
+# $ micropython scripts/bench_http.py http://127.0.0.1:8000/ 200
+# #########################
+"""
+import sys
+sys.path.insert(0, 'frozen')
+import utime
+import urequests
+
+
+def bench(url, n, keep_alive, dns_cache=True):
+    started = utime.ticks_ms()
+    for _ in range(n):
+        if not dns_cache:
+            urequests.dns_invalidate()
+        resp = urequests.get(url, keep_alive=keep_alive)
+        resp.content
+        resp.close()
+    elapsed = utime.ticks_diff(utime.ticks_ms(), started)
+    urequests.pool_clear()
+    return n * 1000 / max(elapsed, 1)
+
+
+def main():
+    url = sys.argv[1] if len(sys.argv) > 1 else 'http://127.0.0.1:8000/'
+    n = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    print('connection: close  {:8.1f} req/s'.format(bench(url, n, False)))
+    print('keep-alive pool    {:8.1f} req/s'.format(bench(url, n, True)))
+    print('no DNS cache       {:8.1f} req/s'.format(bench(url, n, False, dns_cache=False)))
+    stats = urequests.dns_stats
+    print('DNS: {} hits, {} misses, {:.2f} ms/lookup (max {} ms)'.format(
+        stats['hits'], stats['misses'], stats['lookup_ms'] / max(stats['misses'], 1), stats['max_lookup_ms']
+    ))
+
+
+main()
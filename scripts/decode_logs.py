@@ -0,0 +1,100 @@
+"""
+Decode binary log records, from segment files copied off the board or shipped POST bodies
+# #########################
+# $ mpremote cp -r :logs .
+# $ python3 scripts/decode_logs.py logs/*.bin
+# $ python3 scripts/decode_logs.py --json body.bin
+# #########################
+Deflated bodies (zlib header) are inflated first. Must match src/utils/log_records.py
+"""
+import json
+import struct
+import sys
+import zlib
+from datetime import datetime, timezone
+
+RECORD_FORMAT = '<IBHB'
+HEADER_SIZE = struct.calcsize(RECORD_FORMAT)
+# MicroPython's epoch on the ESP32 is 2000-01-01
+EPOCH_OFFSET = 946684800
+
+LEVELS = {0: 'DEBUG', 1: 'INFO', 2: 'WARNING', 3: 'ERROR'}
+# Code -> (name, struct format for binary payloads or None for text, field names)
+CODES = {
+    0: ('message', None, None),
+    1: ('error', None, None),
+    2: ('photo', '<IIII', ('photo_id', 'ms', 'baudrate', 'peak_heap')),
+    3: ('transfer', '<IIIIHB', ('buffer_length', 'bytes', 'elapsed_ms', 'bytes_per_sec', 'retries', 'complete')),
+    4: ('burst', '<HII', ('frames', 'elapsed_ms', 'fps_x100')),
+    5: ('flash', '<IIII', ('bytes', 'writes', 'write_ms', 'max_write_ms')),
+    6: ('camera', '<I', ('baudrate',)),
+    7: ('health', None, None),
+}
+# Code -> (field name, struct format of each repeated item, item field names or None for plain values)
+# for binary payloads that carry a variable-length list after the fixed part
+TAILS = {
+    3: ('chunk_history', '<H', None),
+    6: ('report', '<IIII', ('baudrate', 'verify_ms', 'capture_ms', 'bytes_per_sec')),
+}
+
+
+def decode_payload(code, payload):
+    name, fmt, fields = CODES.get(code, (str(code), None, None))
+    if fmt is None:
+        return name, payload.decode('utf-8', 'replace')
+    size = struct.calcsize(fmt)
+    tail = TAILS.get(code)
+    item_size = struct.calcsize(tail[1]) if tail else 0
+    extra = len(payload) - size
+    if extra < 0 or (extra and not item_size) or (item_size and extra % item_size):
+        # Written before the payload went binary
+        return name, payload.decode('utf-8', 'replace')
+    value = dict(zip(fields, struct.unpack_from(fmt, payload)))
+    if tail:
+        tail_name, item_fmt, item_fields = tail
+        items = [struct.unpack_from(item_fmt, payload, offset) for offset in range(size, len(payload), item_size)]
+        value[tail_name] = [dict(zip(item_fields, item)) if item_fields else item[0] for item in items]
+    return name, value
+
+
+def decode(data):
+    if data[:1] == b'\x78':
+        try:
+            data = zlib.decompress(data)
+        except zlib.error:
+            pass
+    offset = 0
+    while offset + HEADER_SIZE <= len(data):
+        timestamp, level, code, length = struct.unpack_from(RECORD_FORMAT, data, offset)
+        payload = data[offset + HEADER_SIZE:offset + HEADER_SIZE + length]
+        if len(payload) < length:
+            print('Truncated record at offset {}'.format(offset), file=sys.stderr)
+            return
+        offset += HEADER_SIZE + length
+        name, value = decode_payload(code, payload)
+        yield {
+            'time': datetime.fromtimestamp(timestamp + EPOCH_OFFSET, timezone.utc).isoformat(),
+            'level': LEVELS.get(level, str(level)),
+            'code': name,
+            'value': value,
+        }
+
+
+def main(args):
+    as_json = '--json' in args
+    paths = [arg for arg in args if arg != '--json']
+    if not paths:
+        print(__doc__)
+        return 1
+    for path in paths:
+        with open(path, 'rb') as f:
+            for record in decode(f.read()):
+                if as_json:
+                    print(json.dumps(record))
+                else:
+                    print('{time} {level:<7} {code:<9} {value}'.format(**record))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,98 @@
+"""
+Local MQTT broker stand-in for testing telemetry, prints every batch it receives
+# #########################
+# $ python3 scripts/mqtt_test_broker.py 1883
+# Then point a Telemetry at it (MQTT_BROKER_HOST / a client_factory), stop & restart
+# this script to watch the offline queue fill up & drain.
+# #########################
+Speaks just enough MQTT 3.1.1 for amqtt & umqtt.simple: CONNECT, PUBLISH (QoS 0/1), SUBSCRIBE,
+PINGREQ & DISCONNECT.
+"""
+import socketserver
+import struct
+import sys
+
+# Must match src/telemetry.py
+RECORD_FORMAT = '<IBi'
+RECORD_SIZE = struct.calcsize(RECORD_FORMAT)
+KINDS = {1: 'distance', 2: 'capture', 3: 'motion'}
+
+
+def read_exact(sock, n):
+    data = b''
+    while len(data) < n:
+        piece = sock.recv(n - len(data))
+        if not piece:
+            raise EOFError
+        data += piece
+    return data
+
+
+def read_packet(sock):
+    kind = read_exact(sock, 1)[0]
+    length = 0
+    shift = 0
+    while True:
+        byte = read_exact(sock, 1)[0]
+        length |= (byte & 0x7F) << shift
+        if not byte & 0x80:
+            break
+        shift += 7
+    return kind, read_exact(sock, length)
+
+
+def decode(payload):
+    for offset in range(0, len(payload) - RECORD_SIZE + 1, RECORD_SIZE):
+        timestamp, kind, value = struct.unpack_from(RECORD_FORMAT, payload, offset)
+        yield timestamp, KINDS.get(kind, kind), value
+
+
+class Handler(socketserver.BaseRequestHandler):
+    def handle(self):
+        sock = self.request
+        try:
+            while True:
+                kind, body = read_packet(sock)
+                packet_type = kind >> 4
+                if packet_type == 1:
+                    client_id_length = struct.unpack_from('!H', body, 10)[0]
+                    print('CONNECT', body[12:12 + client_id_length].decode())
+                    sock.sendall(b'\x20\x02\x00\x00')
+                elif packet_type == 3:
+                    self.on_publish(sock, kind, body)
+                elif packet_type == 8:
+                    sock.sendall(b'\x90\x03' + body[:2] + b'\x00')
+                elif packet_type == 12:
+                    sock.sendall(b'\xd0\x00')
+                elif packet_type == 14:
+                    print('DISCONNECT')
+                    return
+        except (EOFError, ConnectionError):
+            print('Connection dropped')
+
+    def on_publish(self, sock, kind, body):
+        qos = (kind >> 1) & 0x03
+        topic_length = struct.unpack_from('!H', body)[0]
+        topic = body[2:2 + topic_length].decode()
+        offset = 2 + topic_length
+        if qos:
+            packet_id = body[offset:offset + 2]
+            offset += 2
+            sock.sendall(b'\x40\x02' + packet_id)
+        payload = body[offset:]
+        records = list(decode(payload))
+        print('PUBLISH {} {} bytes, {} records'.format(topic, len(payload), len(records)))
+        for record in records:
+            print('   ', *record)
+
+
+class Server(socketserver.ThreadingMixIn, socketserver.TCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+if __name__ == '__main__':
+    port = int(sys.argv[1]) if len(sys.argv) > 1 else 1883
+    with Server(('0.0.0.0', port), Handler) as server:
+        print('MQTT stand-in listening on', port)
+        server.serve_forever()
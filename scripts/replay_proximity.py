@@ -0,0 +1,145 @@
+"""
+Replay a recorded distance trace through the proximity filter & report false triggers
+# #########################
+# $ python3 scripts/replay_proximity.py trace.csv
+# $ python3 scripts/replay_proximity.py --synthetic 3600  # An hour of generated trace
+# #########################
+Traces are CSV rows of `ticks_ms,distance_cm[,present]`. An empty, `False` or negative
+distance is a failed reading. `present` (0/1) marks when something really was in front of
+the sensor; a trigger outside those stretches counts as false.
+
+The raw baseline is what App.loop used to do: capture on any single reading inside the
+threshold, then nothing for `--capture-ms` while the capture runs.
+"""
+import csv
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'src'))
+try:
+    import micropython  # noqa: F401
+except ImportError:
+    # Off the board, settings.py only needs const() from it
+    from types import ModuleType
+    micropython = ModuleType('micropython')
+    micropython.const = lambda value: value
+    sys.modules['micropython'] = micropython
+from components.proxy.filter import ProximityFilter  # noqa: E402
+from settings import (  # noqa: E402
+    PROXY_DISTANCE_THRESHOLD_CM, PROXY_DWELL_MS, PROXY_FILTER_ALPHA, PROXY_FILTER_WINDOW, PROXY_HYSTERESIS_CM,
+    PROXY_MAX_CM, PROXY_MAX_JUMP_CM, PROXY_MIN_CM, PROXY_SAMPLE_INTERVAL_MS
+)
+
+
+def read_trace(path):
+    with open(path) as f:
+        for row in csv.reader(f):
+            if not row or row[0].startswith('#') or not row[0].strip().lstrip('-').isdigit():
+                continue
+            t_ms = int(row[0])
+            try:
+                distance = float(row[1])
+            except (IndexError, ValueError):
+                distance = False
+            if distance is not False and distance < 0:
+                distance = False
+            present = len(row) > 2 and row[2].strip() == '1'
+            yield t_ms, distance, present
+
+
+def synthetic_trace(seconds, threshold_cm, seed=1):
+    """
+    A wall past the threshold with ultrasonic noise (timeouts, the odd short echo),
+    & a real approach every minute or so
+    """
+    rng = random.Random(seed)
+    background = min(threshold_cm + 150, PROXY_MAX_CM - 20)
+    t_ms = 0
+    next_visit = rng.randint(20, 60) * 1000
+    visit_until = -1
+    while t_ms < seconds * 1000:
+        if t_ms >= next_visit and visit_until < t_ms:
+            visit_until = t_ms + rng.randint(2, 8) * 1000
+            next_visit = visit_until + rng.randint(30, 90) * 1000
+        present = t_ms <= visit_until
+        distance = rng.gauss(threshold_cm // 2 if present else background, 6)
+        roll = rng.random()
+        if roll < 0.03:
+            distance = False
+        elif roll < 0.06:
+            # Multipath / crosstalk, a single short echo
+            distance = rng.uniform(20, threshold_cm - 50)
+        elif roll < 0.08:
+            distance = -1
+        yield t_ms, distance, present
+        t_ms += PROXY_SAMPLE_INTERVAL_MS + rng.randint(-5, 5)
+
+
+def replay(trace, capture_ms, threshold_cm):
+    proximity = ProximityFilter(
+        threshold_cm, threshold_cm + PROXY_HYSTERESIS_CM,
+        window=PROXY_FILTER_WINDOW, alpha=PROXY_FILTER_ALPHA, dwell_ms=PROXY_DWELL_MS,
+        max_jump_cm=PROXY_MAX_JUMP_CM, min_cm=PROXY_MIN_CM, max_cm=PROXY_MAX_CM
+    )
+    raw = {'triggers': 0, 'false': 0}
+    filtered = {'triggers': 0, 'false': 0}
+    busy_until = -1
+    visits = 0
+    was_present = False
+    first_ms = last_ms = None
+    for t_ms, distance, present in trace:
+        first_ms = t_ms if first_ms is None else first_ms
+        last_ms = t_ms
+        if present and not was_present:
+            visits += 1
+        was_present = present
+        if t_ms >= busy_until and distance is not False and distance <= threshold_cm:
+            raw['triggers'] += 1
+            raw['false'] += not present
+            busy_until = t_ms + capture_ms
+        if proximity.update(distance, t_ms):
+            filtered['triggers'] += 1
+            filtered['false'] += not present
+    hours = max((last_ms or 0) - (first_ms or 0), 1) / 3600000
+    return raw, filtered, proximity.stats, visits, hours
+
+
+def report(name, result, hours):
+    triggers = result['triggers']
+    rate = result['false'] / triggers if triggers else 0
+    print('{:<9} {:>5} triggers, {:>5} false ({:5.1%}), {:7.1f} false/hour'.format(
+        name, triggers, result['false'], rate, result['false'] / hours
+    ))
+
+
+def option(args, name, default):
+    if name not in args:
+        return default
+    index = args.index(name)
+    value = int(args[index + 1])
+    del args[index:index + 2]
+    return value
+
+
+def main(args):
+    capture_ms = option(args, '--capture-ms', 5000)
+    threshold_cm = option(args, '--threshold', PROXY_DISTANCE_THRESHOLD_CM)
+    if not args:
+        print(__doc__)
+        return 1
+    if args[0] == '--synthetic':
+        seconds = int(args[1]) if len(args) > 1 else 600
+        trace = synthetic_trace(seconds, threshold_cm)
+    else:
+        trace = read_trace(args[0])
+    raw, filtered, stats, visits, hours = replay(trace, capture_ms, threshold_cm)
+    print('{} real approaches over {:.2f} hours'.format(visits, hours))
+    report('raw', raw, hours)
+    report('filtered', filtered, hours)
+    print('filter:', stats)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -1,17 +1,46 @@
 from gc import collect
 from machine import Pin, I2C, UART
-from uasyncio import get_event_loop, run, sleep
-from utime import time
+from uasyncio import Event, TimeoutError, create_task, get_event_loop, run, sleep, sleep_ms, wait_for_ms
+from ustruct import pack
+from utime import ticks_diff, ticks_ms, time
 from typing import List, Optional, Union, Any
 
 from constants import ONE, TWO, ZERO
+from board_networks import wifi
 from components.shared import Buses
 from components.button.component import Button
 from components.camera import Camera
 from components.led import Leds
 from components.proxy.component import Proxy
-from settings import PROXY_DISTANCE_THRESHOLD_CM, SLEEP_DURATION_MS
-from utils.logger import Logger
+from components.proxy.filter import ProximityFilter
+from components.proxy.sampler import ProxySampler
+from photo_store import PhotoStore
+from telemetry import KIND_CAPTURE, KIND_DISTANCE, KIND_MOTION, Telemetry
+from uploader import Uploader
+from settings import (
+    CAMERA_BURST_FRAMES, CAMERA_BURST_INTERVAL_MS, CAMERA_BURST_TRIGGERS, CAMERA_DEFAULT_TRIGGER,
+    CAMERA_MOTION_DETECTION, GOVERNOR_CHANGE_CM, GOVERNOR_DECAY_MS, GOVERNOR_IDLE_TICK_MS,
+    GOVERNOR_MAX_LEVEL, PROXY_DISTANCE_THRESHOLD_CM, PROXY_DWELL_MS, PROXY_FILTER_ALPHA,
+    PROXY_FILTER_WINDOW, PROXY_HYSTERESIS_CM, PROXY_MAX_CM, PROXY_MAX_JUMP_CM, PROXY_MIN_CM,
+    PROXY_IDLE_INTERVAL_MS, PROXY_SAMPLE_INTERVAL_MS,
+    SLEEP_DURATION_MS, TICK_RATE_MS,
+    TRIGGER_BUTTON, TRIGGER_MOTION, TRIGGER_PROXY
+)
+from utils.buffered_writer import stats as flash_stats
+from utils.governor import Governor
+from utils.health import Health, is_false, is_none
+from utils.log_records import (
+    CODE_BURST, CODE_CAMERA, CODE_FLASH, CODE_PHOTO, CODE_TRANSFER, pack_baud_report, pack_burst, pack_transfer
+)
+from utils.logger import logger
+
+
+# Components with their own circuit breaker, see utils.health
+COMPONENT_APP = 'app'
+COMPONENT_BUTTON = 'button'
+COMPONENT_PROXY = 'proxy'
+COMPONENT_LEDS = 'leds'
+COMPONENT_CAMERA = 'camera'
 
 
 def runtime():
@@ -32,80 +61,270 @@ class App:
     def __init__(self):
         self.run = True
         self.buses = Buses()
-        self.logger = Logger()
+        self.logger = logger
+        self.health = Health(logger)
         self.button = None
         self.proxy = None
+        # Only real approaches trigger a capture, not single noisy readings
+        self.proximity = ProximityFilter(
+            PROXY_DISTANCE_THRESHOLD_CM,
+            PROXY_DISTANCE_THRESHOLD_CM + PROXY_HYSTERESIS_CM,
+            window=PROXY_FILTER_WINDOW,
+            alpha=PROXY_FILTER_ALPHA,
+            dwell_ms=PROXY_DWELL_MS,
+            max_jump_cm=PROXY_MAX_JUMP_CM,
+            min_cm=PROXY_MIN_CM,
+            max_cm=PROXY_MAX_CM
+        )
+        # Polls slowly while the cabin's empty, fast while something's going on
+        self.governor = Governor(SLEEP_DURATION_MS, GOVERNOR_DECAY_MS, GOVERNOR_MAX_LEVEL)
+        # Reads the proxy in the background, through captures too
+        self.sampler = ProxySampler(
+            self.read_proxy,
+            self.proximity,
+            self.governor.rate(PROXY_SAMPLE_INTERVAL_MS, PROXY_IDLE_INTERVAL_MS),
+            on_change=self.activity,
+            change_cm=GOVERNOR_CHANGE_CM,
+            on_error=self.sampler_error
+        )
         self.leds = None
         self.camera = None
+        self.store = PhotoStore()
+        self.wifi = wifi
+        self.uploader = Uploader(self.store, wifi=wifi)
+        self.telemetry = Telemetry()
+        self.motion = Event()
+        self.tasks = []
 
     def stop(self):
         self.run = False
+        for task in self.tasks:
+            task.cancel()
+        self.tasks = []
+
+    def start_task(self, coro):
+        """
+        Run `coro` in the background for the life of the app
+        """
+        task = create_task(coro)
+        self.tasks.append(task)
+        return task
 
     async def run_forever(self):
+        health = self.health
         while self.run:
+            # Takes an open circuit to half open once its backoff is up, so the next failure
+            # backs off for twice as long
+            if not health.is_available(COMPONENT_APP):
+                await sleep_ms(health.retry_in_ms(COMPONENT_APP))
+                continue
             try:
                 collect_after = await self.loop()
-                self.leds.off()
+                health.success(COMPONENT_APP)
+                health.call(COMPONENT_LEDS, self.leds.off)
                 if collect_after:
                     collect()
             except Exception as err:
                 try:
-                    await self.handle_error(err)
+                    self.handle_error(COMPONENT_APP, err)
                 except Exception as fuck:
                     print('Error handler threw this error!!!!11!', fuck)
+                # Only errors nothing else caught land here, back off until the app's circuit closes
+                await sleep_ms(health.retry_in_ms(COMPONENT_APP))
 
     async def setup(self):
         buses = self.buses
+        # Wi-Fi connects in the background, capture doesn't wait for the AP
+        self.wifi.busy = self.uploader.is_busy
+        self.start_task(self.wifi.run())
+        self.logger.wifi = self.wifi
+        self.start_task(self.logger.run())
+        self.store.load()
+        self.start_task(self.uploader.run())
+        self.start_task(self.telemetry.run())
+        # A component that fails to set up starts with a failure against its circuit,
+        # the rest of the board carries on without it
+        health = self.health
         # noinspection PyTypeChecker
-        self.button = Button(buses)
-        await self.button.setup()
+        self.button = Button(buses, on_change=self.activity)
+        await health.call_async(COMPONENT_BUTTON, self.button.setup, failed=is_false)
         # noinspection PyTypeChecker
         self.proxy = Proxy(buses)
-        await self.proxy.setup()
+        await health.call_async(COMPONENT_PROXY, self.proxy.setup, failed=is_false)
+        self.start_task(self.sampler.run())
         self.leds = Leds()
-        await self.leds.setup()
+        await health.call_async(COMPONENT_LEDS, self.leds.setup)
         # noinspection PyTypeChecker
         self.camera = Camera(buses)
-        await self.camera.setup()
+        await health.call_async(COMPONENT_CAMERA, self.camera.setup, failed=is_false)
+        self.logger.event(CODE_CAMERA, pack_baud_report(self.camera.baudrate, self.camera.baud_report))
+        if CAMERA_MOTION_DETECTION and self.camera.is_ready:
+            await self.camera.enable_motion_detection()
+            self.start_task(self.watch_motion())
         return True
 
     async def loop(self):
         collect_after_this = False
-        distance = await self.proxy.get_distance()
-        is_close_enough = PROXY_DISTANCE_THRESHOLD_CM >= distance
-        if is_close_enough or self.button.is_pressed():
-            collect_after_this = await handle_photo(self)
+        health = self.health
+        tick_ms = self.update_rates()
+        if health.call(COMPONENT_BUTTON, self.button.is_pressed, default=False):
+            collect_after_this = await self.take_photo(TRIGGER_BUTTON)
+        elif self.camera.motion_enabled and health.is_available(COMPONENT_CAMERA):
+            # The camera watches for motion, no need to poll the proxy as well
+            self.sampler.pause()
+            # Sleep until the camera reports motion, waking up every tick to check the button
+            try:
+                await wait_for_ms(self.motion.wait(), tick_ms)
+            except TimeoutError:
+                return collect_after_this
+            self.motion.clear()
+            self.telemetry.record(KIND_MOTION, ONE)
+            collect_after_this = await self.take_photo(TRIGGER_MOTION)
+        elif self.sampler.take_approach():
+            collect_after_this = await self.take_photo(TRIGGER_PROXY)
+        else:
+            # No motion engine (or its circuit is open), the proxy takes over
+            self.sampler.resume()
+            # The sampler reads the proxy, sleep until it reports an approach, waking up
+            # every tick to check the button
+            try:
+                await wait_for_ms(self.sampler.approach.wait(), tick_ms)
+            except TimeoutError:
+                pass
         return collect_after_this
 
-    async def handle_error(self, exception: Exception):
-        self.logger.error(exception)
-        self.leds.red.on()
-        await sleep(6)
+    def activity(self, *args):
+        """
+        Something's happening (proximity changing, the button, a capture), poll fast
+        """
+        self.governor.activity()
+        self.update_rates()
 
+    def update_rates(self) -> int:
+        """
+        Apply the governor's current rates
+        :returns int: How long the main loop waits per tick
+        """
+        governor = self.governor
+        governor.update()
+        self.sampler.interval_ms = governor.rate(PROXY_SAMPLE_INTERVAL_MS, PROXY_IDLE_INTERVAL_MS)
+        return governor.rate(TICK_RATE_MS, GOVERNOR_IDLE_TICK_MS)
 
-async def handle_photo(app: App):
-    collect_after_this = False
-    app.leds.blue.on()
-    if app.camera.take_photo():
-        collect_after_this = True
+    def sampler_error(self, err: Exception):
+        """
+        Anything the sampler's read, filter or callbacks raised, counted against the proxy
+        """
+        self.handle_error(COMPONENT_PROXY, err)
+
+    async def read_proxy(self):
+        """
+        One reading for the sampler, behind the proxy's circuit breaker
+        """
+        distance = await self.health.call_async(COMPONENT_PROXY, self.proxy.async_get_distance, default=False)
+        if distance is not False:
+            self.telemetry.reading(KIND_DISTANCE, int(distance))
+        return distance
+
+    async def take_photo(self, trigger: int) -> bool:
+        """
+        `handle_photo` behind the camera's circuit breaker, False while it's open
+        """
+        self.activity()
+        is_saved = await self.health.call_async(
+            COMPONENT_CAMERA, handle_photo, self, trigger, default=False, failed=is_false
+        )
+        if self.health.retry_in_ms(COMPONENT_CAMERA):
+            self.health.call(COMPONENT_LEDS, self.leds.red.on)
+        return is_saved
+
+    async def watch_motion(self):
+        camera = self.camera
+        health = self.health
+        while self.run:
+            # A garbled frame counts against the camera, quiet polls don't
+            if await health.call_async(COMPONENT_CAMERA, camera.wait_for_motion, default=False, failed=is_none):
+                self.motion.set()
+            # Don't spin while the camera's circuit is open
+            await sleep_ms(health.retry_in_ms(COMPONENT_CAMERA))
+
+    def handle_error(self, component: str, exception: Exception):
+        """
+        Count the error against `component` (logged the first time it's seen) & show red
+        """
+        self.health.failure(component, exception)
+        if self.leds is not None:
+            self.health.call(COMPONENT_LEDS, self.leds.red.on)
+
+
+async def handle_photo(app: App, trigger: int = CAMERA_DEFAULT_TRIGGER):
+    camera = app.camera
+    frames = CAMERA_BURST_FRAMES if trigger in CAMERA_BURST_TRIGGERS else ONE
+    stamp = time()
+
+    async def save_frame(index: int) -> bool:
+        started = ticks_ms()
         try:
-            photo_bytes = app.camera.read_photo_from_buffer()
-            write_photo(photo_bytes)
-            app.leds.green.on()
-            # Green LED lets us know that the image was written successfully
-            await sleep(5)
+            photo_id = await stream_photo(camera, app.store, stamp)
         except Exception as err:
-            print('Error while writing photo (read went smoothly)', err)
-        finally:
-            # Always reset the camera after we successfully take a picture
-            app.camera.reset()
+            app.logger.error(err)
+            return False
+        if photo_id is None:
+            # Nothing in the camera buffer, or the transfer didn't complete
+            return False
+        app.logger.event(CODE_PHOTO, pack(
+            '<IIII',
+            photo_id,
+            ticks_diff(ticks_ms(), started),
+            camera.baudrate,
+            camera.heap.peak_delta()
+        ))
+        app.logger.event(CODE_TRANSFER, pack_transfer(camera.transfer.stats))
+        return True
+
+    app.leds.blue.on()
+    async with camera.lock:
+        # Motion frames would land in the middle of the transfer, pause them until we're done
+        resume_motion = camera.motion_enabled
+        await camera.enable_motion_detection(False)
+        await camera.apply_profile(trigger)
+        saved = await camera.capture_burst(frames, CAMERA_BURST_INTERVAL_MS, save_frame)
+        if resume_motion:
+            await camera.enable_motion_detection()
+    if frames > ONE:
+        app.logger.event(CODE_BURST, pack_burst(camera.burst_stats))
+    flash = flash_stats()
+    app.logger.event(CODE_FLASH, pack(
+        '<IIII', flash['bytes'], flash['writes'], flash['write_ms'], flash['max_write_ms']
+    ))
+    app.telemetry.record(KIND_CAPTURE, trigger)
+    if saved:
+        app.uploader.notify()
+        # Green LED lets us know that the image was written successfully
+        app.leds.green.on()
+        await sleep(5)
     app.leds.blue.off()
-    return collect_after_this
+    return saved > ZERO
 
 
-def write_photo(photo_bytes: List[int]):
-    file_name = 'photo_' + str(time()) + '.jpg'
-    with open(file_name, 'wb') as img:
-        img.write(
-            bytearray(photo_bytes)
-        )
+async def stream_photo(camera: Camera, store: PhotoStore, stamp: Optional[int] = None) -> Optional[int]:
+    """
+    Write the frame buffer to flash one chunk at a time.
+    The store only keeps the photo once it verifies, so a failed transfer
+    never leaves a truncated photo behind. Frames in a burst share `stamp`
+    & are told apart by their (sequential) photo ids.
+
+    :returns int|None: Id of the saved photo
+    """
+    buffer_length = await camera.get_buffer_length()
+    if not buffer_length:
+        return None
+    writer = store.open_writer(buffer_length, stamp)
+    try:
+        is_complete = await camera.read_chunks(buffer_length, writer.write)
+    except Exception:
+        store.abort(writer)
+        raise
+    if not is_complete:
+        store.abort(writer)
+        return None
+    return store.commit(writer)
@@ -1,26 +1,135 @@
-from mqtt import MQTTClient
-from network import WLAN
-from constants import BROKER_HOST, BROKER_PORT, WLAN_HOST, WLAN_PASSWORD
+from network import STA_IF, WLAN
+from uasyncio import Event, sleep_ms
+from utime import ticks_diff, ticks_ms
 
+from constants import ZERO, ONE, TWO
+from settings import (
+    MQTT_BROKER_HOST, MQTT_BROKER_PORT, MQTT_KEEPALIVE_SEC, WIFI_CHECK_MS, WIFI_CONNECT_TIMEOUT_MS,
+    WIFI_POLL_MS, WIFI_RETRY_BASE_MS, WIFI_RETRY_MAX_MS, WLAN_HOST, WLAN_PASSWORD
+)
 
-wlan = WLAN(mode=WLAN.STA)
+try:
+    from umqtt.simple import MQTTClient
+except ImportError:
+    MQTTClient = None
 
-wlan.connect(WLAN_HOST, auth=(WLAN.WPA2, WLAN_PASSWORD))
+# Power-save modes only exist on newer firmware, None means we can't switch
+_PM_NONE = getattr(WLAN, 'PM_NONE', None)
+_PM_POWERSAVE = getattr(WLAN, 'PM_POWERSAVE', None)
+
+
+class WifiManager:
+    """
+    Keeps the station interface connected in the background.
+    Nothing blocks on the AP: boot carries on & the rest of the app
+    waits on `connected` (or checks `is_connected()`) when it needs the network.
+
+    >>> app.start_task(wifi.run())
+    >>> wifi.busy = uploader.is_busy  # Full power while there's something to upload
+    >>> await wifi.connected.wait()
+    >>> wifi.stats  # {'connects', 'drops', 'failures', 'connect_ms', 'power_save'}
+    """
+    def __init__(self, ssid: str = WLAN_HOST, password: str = WLAN_PASSWORD):
+        self.ssid = ssid
+        self.password = password
+        self.wlan = WLAN(STA_IF)
+        self.connected = Event()
+        self.disconnected = Event()
+        self.disconnected.set()
+        # Returns True while there's network work pending, see `_update_power_save`
+        self.busy = None
+        self.backoff_ms = WIFI_RETRY_BASE_MS
+        self.stats = {
+            'connects': ZERO,
+            'drops': ZERO,
+            'failures': ZERO,
+            'connect_ms': ZERO,
+            'power_save': None,
+        }
+
+    def is_connected(self) -> bool:
+        return self.wlan.isconnected()
+
+    async def run(self):
+        self.wlan.active(True)
+        while True:
+            if self.is_connected():
+                self._set_connected(True)
+                self._update_power_save()
+                await sleep_ms(WIFI_CHECK_MS)
+                continue
+            if self.connected.is_set():
+                self.stats['drops'] += ONE
+                self._set_connected(False)
+            if await self.connect():
+                self.backoff_ms = WIFI_RETRY_BASE_MS
+                continue
+            self.stats['failures'] += ONE
+            await sleep_ms(self.backoff_ms)
+            self.backoff_ms = min(self.backoff_ms * TWO, WIFI_RETRY_MAX_MS)
+
+    async def connect(self) -> bool:
+        """
+        One connect attempt, polled so the event loop keeps running while the AP answers
+        """
+        wlan = self.wlan
+        started = ticks_ms()
+        try:
+            wlan.connect(self.ssid, self.password)
+        except OSError as err:
+            print('Wi-Fi connect failed', err)
+            return False
+        while ticks_diff(ticks_ms(), started) < WIFI_CONNECT_TIMEOUT_MS:
+            if wlan.isconnected():
+                self.stats['connects'] += ONE
+                self.stats['connect_ms'] = ticks_diff(ticks_ms(), started)
+                self._set_connected(True)
+                return True
+            await sleep_ms(WIFI_POLL_MS)
+        # Stop the driver retrying on its own, we'll try again after the backoff
+        wlan.disconnect()
+        return False
+
+    def _set_connected(self, is_connected: bool):
+        if is_connected:
+            self.disconnected.clear()
+            self.connected.set()
+        else:
+            self.connected.clear()
+            self.disconnected.set()
+
+    def _update_power_save(self):
+        if _PM_POWERSAVE is None:
+            return
+        mode = _PM_NONE if self.busy is not None and self.busy() else _PM_POWERSAVE
+        if mode != self.stats['power_save']:
+            self.wlan.config(pm=mode)
+            self.stats['power_save'] = mode
+
+
+# Shared by everything on the board, nothing connects until `wifi.run()` is started
+wifi = WifiManager()
 
 
 class Mqtt:
     """
     NOTE: Subclass this to implement an MQTT Broker w/ your own callback
-    Your class must implement the 'callback' method, which is passed directly into
+    Override the 'callback' method, which is passed directly into
     MQTTClient().set_callback(self.callback)
     See: `setup` method
     """
-    def __init__(self, device_id, host=BROKER_HOST, port=BROKER_PORT):
-        self.client = MQTTClient(device_id, host, port=port)
+    def __init__(self, device_id, host=MQTT_BROKER_HOST, port=MQTT_BROKER_PORT):
+        if MQTTClient is None:
+            raise ImportError('umqtt.simple is not installed')
+        # The port comes out of settings as a string
+        self.client = MQTTClient(device_id, host, port=int(port), keepalive=MQTT_KEEPALIVE_SEC)
         self.is_connected = False
 
+    def callback(self, topic, message):
+        pass
+
     def setup(self):
-        if not wlan.isconnected():
+        if not wifi.is_connected():
             return None
         client = self.client
         client.set_callback(self.callback)
@@ -29,10 +138,21 @@ class Mqtt:
             self.is_connected = True
         return client
 
+    def disconnect(self):
+        if self.is_connected:
+            self.is_connected = False
+            try:
+                self.client.disconnect()
+            except OSError:
+                pass
+
+    def ping(self):
+        return self.client.ping()
+
     def subscribe(self, *args, **kwargs):
-        return self.client.subscribe(**kwargs)
+        return self.client.subscribe(*args, **kwargs)
 
     def publish(self, *args, **kwargs):
-        return self.client.publish(**kwargs)
+        return self.client.publish(*args, **kwargs)
 
 
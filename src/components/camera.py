@@ -4,14 +4,23 @@ Adapted from Adafruit's Raspberry Pi interface
 Source: https://github.com/adafruit/Adafruit-VC0706-Serial-Camera-Library/blob/master/raspi_camera.py
 """
 from micropython import const
-from machine import UART
-from constants import ZERO, ONE
-from typing import List, Optional, Union, Any
+from uasyncio import Lock, StreamReader, StreamWriter, TimeoutError, sleep_ms, wait_for_ms
+from utime import ticks_add, ticks_diff, ticks_ms
+from constants import ZERO, ONE, THREE, FOUR, THOUSAND
+from typing import Any, Callable, Dict, List, Optional, Union
+from settings import (
+    CAMERA_BAUD_FILE, CAMERA_BAUD_RATES, CAMERA_BAUD_VERIFY_ATTEMPTS, CAMERA_COMMAND_TIMEOUT_MS, CAMERA_MAX_CHUNK,
+    CAMERA_BURST_FRAMES, CAMERA_DEFAULT_TRIGGER, CAMERA_MOTION_POLL_MS, CAMERA_PROFILES,
+    CAMERA_SIZE_160X120, CAMERA_SIZE_320X240, CAMERA_SIZE_640X480, UART_BAUDRATE
+)
+from utils.buffered_writer import BufferedWriter
+from utils.memory import HeapMonitor
+from .camera_transfer import TransferController
 from .shared import Buses
 
 
 FIVE = const(5)
-INC = const(8192)
+INC = CAMERA_MAX_CHUNK
 BAUD = const(38400)
 # this is the port on the Raspberry Pi; it will be different for serial ports on other systems.
 PORT = "/dev/ttyAMA0"
@@ -27,88 +36,510 @@ RESET = const(0x26)
 TAKE_PHOTO = const(0x36)
 READ_BUFF = const(0x32)
 GET_BUFF_LEN = const(0x34)
+GET_VERSION = const(0x11)
+SET_PORT = const(0x24)
+READ_DATA = const(0x30)
+WRITE_DATA = const(0x31)
+COMM_MOTION_CTRL = const(0x37)
+COMM_MOTION_DETECTED = const(0x39)
+MOTION_CTRL = const(0x42)
+
+# MOTION_CTRL args: motion control, report motion over the UART, activate the motion engine
+MOTION_CONTROL = ZERO
+UART_MOTION = ONE
+ACTIVATE_MOTION = ONE
+
+# Downsizing happens in RAM & applies to the next frame, unlike the image size in SPI flash
+DOWNSIZE_CTRL = const(0x54)
+DOWNSIZE_STATUS = const(0x55)
+
+# Data types & register addresses for READ_DATA/WRITE_DATA
+CHIP_REGISTER = ONE
+COMPRESSION_ADDR = (0x12, 0x04)
 
 FBUF_CURRENT_FRAME = ZERO
 FBUF_NEXT_FRAME = ONE
 
 FBUF_STOP_CURRENT_FRAME = ZERO
+FBUF_RESUME_FRAME = THREE
+
+# Baud rate -> the 2 byte divider the VC0706 expects in a set port command
+BAUD_RATE_DIVIDERS = {
+    9600: (0xAE, 0xC8),
+    19200: (0x56, 0xE4),
+    38400: (0x2A, 0xF2),
+    57600: (0x1C, 0x1C),
+    115200: (0x0D, 0xA6),
+}
 
 reset_command = [SEND, SERIAL_NUM, RESET, END]
 take_photo_command = [SEND, SERIAL_NUM, TAKE_PHOTO, ONE, FBUF_STOP_CURRENT_FRAME]
 get_buffer_len_command = [SEND, SERIAL_NUM, GET_BUFF_LEN, ONE, FBUF_CURRENT_FRAME]
 read_photo_command = [SEND, SERIAL_NUM, READ_BUFF, 0x0c, FBUF_CURRENT_FRAME, 0x0a]
+resume_command = [SEND, SERIAL_NUM, TAKE_PHOTO, ONE, FBUF_RESUME_FRAME]
+get_version_command = [SEND, SERIAL_NUM, GET_VERSION, END]
+motion_status_command = [SEND, SERIAL_NUM, MOTION_CTRL, THREE, MOTION_CONTROL, UART_MOTION, ACTIVATE_MOTION]
+get_image_size_command = [SEND, SERIAL_NUM, DOWNSIZE_STATUS, END]
+# Byte offsets of the frame buffer address & length within a full read command
+_READ_ADDR_INDEX = const(6)
+_READ_LEN_INDEX = const(10)
 
 
 class Camera:
+    """
+    Async VC0706 driver. All I/O goes through uasyncio streams over `Buses.uart`,
+    so the event loop keeps running (buttons, proxy, LEDs) while a frame transfers.
+
+    >>> camera = Camera(Buses())
+    >>> await camera.setup()
+    >>> if await camera.take_photo():
+    >>>     with open('photo.jpg', 'wb') as f:
+    >>>         await camera.read_chunks(await camera.get_buffer_length(), f.write)
+    """
     def __init__(self, buses: Buses):
         self.serial = buses.uart
+        self.reader = StreamReader(self.serial)
+        self.writer = StreamWriter(self.serial, {})
+        self.baudrate = UART_BAUDRATE
+        # Baud rate -> {'verify_ms', 'capture_ms', 'bytes_per_sec'}, see `negotiate_baudrate`
+        self.baud_report = {}
+        # Last image size & compression sent to the camera, so captures only send what changed
+        self.image_size = None
+        self.compression = None
+        self.motion_enabled = False
+        # {'frames', 'elapsed_ms', 'fps'} for the last `capture_burst`
+        self.burst_stats = {}
+        # Hold this for any command/reply exchange that mustn't interleave with the motion watcher
+        self.lock = Lock()
         self.is_ready = False
+        self.heap = HeapMonitor()
+        # Reused by every chunk read so the read loops don't allocate
+        self._header = bytearray(FIVE)
+        # A motion frame can straddle `wait_for_motion` polls, what's arrived so far waits here
+        self._motion_frame = bytearray(FIVE)
+        self._motion_count = ZERO
+        self._read_command = bytearray(read_photo_command + [ZERO] * 8 + [ONE, ZERO])
+        # Allocated on the first `read_chunks` call
+        self._chunk = None
+        self.transfer = TransferController(max_chunk=INC)
 
     async def setup(self):
-        self.is_ready = True
+        self.is_ready = await self.negotiate_baudrate()
+        if self.is_ready:
+            self.image_size = await self.get_image_size()
+            await self.apply_profile(CAMERA_DEFAULT_TRIGGER)
+        return self.is_ready
+
+    # Image size & compression
+    # ##############
+    async def apply_profile(self, trigger: int) -> bool:
+        """
+        Switch to the image size & compression in `CAMERA_PROFILES` for `trigger`.
+        Settings the camera already has are not re-sent.
+        """
+        size, compression = CAMERA_PROFILES[trigger]
+        is_sized = await self.set_image_size(size)
+        is_compressed = await self.set_compression(compression)
+        return is_sized and is_compressed
+
+    async def set_image_size(self, size: int) -> bool:
+        """
+        Downsize from the full 640x480 frame. This only touches RAM & takes effect straight
+        away, so switching profiles neither wears the camera's flash nor needs a reset.
+        Not re-sent when the size hasn't changed (e.g. profiles that only differ in compression)
+
+        :param int size: One of the `CAMERA_SIZE_*` settings, which are also the downsize ratios
+        """
+        if size == self.image_size:
+            return True
+        await self.write([SEND, SERIAL_NUM, DOWNSIZE_CTRL, ONE, size])
+        if not check_reply(await self.read(FIVE), DOWNSIZE_CTRL):
+            return False
+        self.image_size = size
+        return True
+
+    async def get_image_size(self) -> Optional[int]:
+        await self.write(get_image_size_command)
+        reply = await self.read(6)
+        if check_reply(reply, DOWNSIZE_STATUS) and len(reply) == 6:
+            return reply[5]
+        return None
+
+    async def set_compression(self, compression: int) -> bool:
+        """
+        :param int compression: JPEG compression ratio, 0x00 - 0xFF
+        """
+        if compression == self.compression:
+            return True
+        if not await self._write_data(CHIP_REGISTER, COMPRESSION_ADDR, compression):
+            return False
+        self.compression = compression
+        return True
+
+    async def _write_data(self, data_type: int, addr: tuple, value: int) -> bool:
+        await self.write(write_data_command(data_type, addr, value))
+        return check_reply(await self.read(FIVE), WRITE_DATA)
+
+    # Motion detection
+    # ##############
+    async def enable_motion_detection(self, enable: bool = True) -> bool:
+        """
+        With motion detection on, the camera sends an unsolicited `COMM_MOTION_DETECTED`
+        reply whenever it sees motion. See `wait_for_motion`
+        """
+        if enable == self.motion_enabled:
+            return True
+        # Half a frame from before doesn't belong to whatever comes next
+        self._motion_count = ZERO
+        if enable:
+            await self.write(motion_status_command)
+            if not check_reply(await self.read(FIVE), MOTION_CTRL):
+                return False
+        else:
+            # A motion frame may already be on its way, don't mistake it for our reply
+            await self.flush_input()
+        await self.write([SEND, SERIAL_NUM, COMM_MOTION_CTRL, ONE, int(enable)])
+        if not check_reply(await self.read(FIVE), COMM_MOTION_CTRL):
+            return False
+        self.motion_enabled = enable
         return True
 
-    def take_photo(self):
-        self.write(take_photo_command)
-        reply: List[int] = list(self.read(5))
-        return check_reply(reply, TAKE_PHOTO) and reply[3] == chr(0x0)
-
-    def read_photo_from_buffer(self):
-        return self.read_buffer(
-            self.get_buffer_length()
-        )
-
-    def read_buffer(self, buffer_length: int) -> Optional[List[int]]:
-        addr = 0  # the initial offset into the frame buffer
-        photo: list[Any] = []
-        # bytes to read each time (must be a multiple of 4)
-        inc = INC
+    async def wait_for_motion(self, timeout_ms: int = CAMERA_MOTION_POLL_MS) -> Optional[bool]:
+        """
+        Listen for a motion frame for up to `timeout_ms`.
+        The UART is only held for that long, so captures can get in between polls.
+        Bytes are read as they arrive & kept until the frame is complete, so a frame
+        cut off by the end of one poll is finished by the next.
+
+        :returns bool|None: True on motion, False if nothing came in,
+            None if something other than a motion frame did
+
+        >>> await camera.enable_motion_detection()
+        >>> while True:
+        >>>     if await camera.wait_for_motion():
+        >>>         motion_event.set()
+        """
+        if not self.motion_enabled:
+            await sleep_ms(timeout_ms)
+            return False
+        frame = self._motion_frame
+        async with self.lock:
+            self._motion_count += await self.read_into(memoryview(frame)[self._motion_count:], timeout_ms)
+        if self._motion_count < FIVE:
+            return False
+        self._motion_count = ZERO
+        if check_reply(frame, COMM_MOTION_DETECTED):
+            return True
+        # Out of step, keep from the next byte that could start a reply so the frame after lines up
+        for start in range(ONE, FIVE):
+            if frame[start] == REPLY:
+                frame[:FIVE - start] = frame[start:]
+                self._motion_count = FIVE - start
+                break
+        return None
+
+    # Baud rate
+    # ##############
+    async def negotiate_baudrate(self) -> bool:
+        """
+        Find the rate the camera is currently listening at, then step up through
+        `CAMERA_BAUD_RATES` (fastest first) & keep the first one that verifies.
+        The working rate is saved so the next boot finds the camera on the first try.
+        """
+        current = await self.find_baudrate()
+        if current is None:
+            print('Camera did not respond at any baud rate')
+            return False
+        for baudrate in CAMERA_BAUD_RATES:
+            if baudrate <= current:
+                break
+            if await self.switch_baudrate(baudrate):
+                break
+        if not await self.verify_baudrate():
+            # A failed switch can leave the camera somewhere unexpected
+            if await self.find_baudrate() is None:
+                return False
+        save_baudrate(self.baudrate)
+        return True
+
+    async def find_baudrate(self) -> Optional[int]:
+        """
+        Probe the saved rate first, then the VC0706 power-on default, then everything else
+        """
+        candidates = [load_baudrate(), BAUD] + list(CAMERA_BAUD_RATES)
+        tried = []
+        for baudrate in candidates:
+            if baudrate is None or baudrate in tried:
+                continue
+            tried.append(baudrate)
+            await self.set_uart_baudrate(baudrate)
+            if await self.verify_baudrate():
+                return baudrate
+        return None
+
+    async def switch_baudrate(self, baudrate: int) -> bool:
+        """
+        Ask the camera to move to `baudrate`, then move the ESP32 UART to match.
+        Falls back to the previous rate if the camera doesn't verify at the new one.
+        """
+        previous = self.baudrate
+        await self.write(set_port_command(baudrate))
+        if not check_reply(await self.read(FIVE), SET_PORT):
+            return False
+        await self.set_uart_baudrate(baudrate)
+        if await self.verify_baudrate():
+            return True
+        await self.write(set_port_command(previous))
+        await self.set_uart_baudrate(previous)
+        return False
+
+    async def set_uart_baudrate(self, baudrate: int):
+        self.serial.init(baudrate=baudrate)
+        self.baudrate = baudrate
+        # Let the line settle & drop anything garbled by the switch
+        await sleep_ms(10)
+        await self.flush_input()
+
+    async def verify_baudrate(self) -> bool:
+        """
+        The rate only counts as working if every one of `CAMERA_BAUD_VERIFY_ATTEMPTS`
+        version requests comes back intact.
+        """
+        started = ticks_ms()
+        for _ in range(CAMERA_BAUD_VERIFY_ATTEMPTS):
+            if await self.get_version() is None:
+                return False
+        elapsed = ticks_diff(ticks_ms(), started)
+        self._report(self.baudrate)['verify_ms'] = elapsed // CAMERA_BAUD_VERIFY_ATTEMPTS
+        return True
+
+    async def benchmark_baudrates(self) -> Dict[int, dict]:
+        """
+        Capture & transfer one frame at every rate in `CAMERA_BAUD_RATES` that verifies,
+        then return to the fastest working rate.
+        Results land in `self.baud_report`.
+        """
+        fastest = None
+        for baudrate in CAMERA_BAUD_RATES:
+            if baudrate != self.baudrate and not await self.switch_baudrate(baudrate):
+                continue
+            if fastest is None:
+                fastest = baudrate
+            if not await self.take_photo():
+                continue
+            buffer_length = await self.get_buffer_length()
+            started = ticks_ms()
+            is_complete = await self.read_chunks(buffer_length, lambda view: None)
+            elapsed = ticks_diff(ticks_ms(), started)
+            await self.resume()
+            if is_complete:
+                report = self._report(baudrate)
+                report['capture_ms'] = elapsed
+                report['bytes_per_sec'] = (buffer_length * THOUSAND) // max(elapsed, ONE)
+        if fastest is not None and fastest != self.baudrate:
+            await self.switch_baudrate(fastest)
+        return self.baud_report
+
+    def _report(self, baudrate: int) -> dict:
+        if baudrate not in self.baud_report:
+            self.baud_report[baudrate] = {}
+        return self.baud_report[baudrate]
+
+    async def get_version(self) -> Optional[bytes]:
+        await self.write(get_version_command)
+        header = await self.read(FIVE)
+        if not check_reply(header, GET_VERSION) or len(header) != FIVE:
+            return None
+        # The last header byte is the length of the version string that follows
+        return await self.read(header[4])
+
+    async def resume(self) -> bool:
+        """
+        Release the frozen frame so the camera starts capturing again
+        """
+        await self.write(resume_command)
+        return check_reply(await self.read(FIVE), TAKE_PHOTO)
+
+    async def take_photo(self) -> bool:
+        await self.write(take_photo_command)
+        reply = await self.read(FIVE)
+        return check_reply(reply, TAKE_PHOTO)
+
+    # Burst capture
+    # ##############
+    async def capture_burst(self, frames: int, interval_ms: int, save_frame: Callable) -> int:
+        """
+        Freeze, save & resume `frames` frames in a row, starting one every `interval_ms`
+        (or as fast as the transfer allows).
+
+        :param int frames: Number of frames to capture
+        :param int interval_ms: Target time between the start of each frame
+        :param save_frame: `async save_frame(index) -> bool`, reads the frozen frame out of the camera
+        :returns int: Number of frames saved. Timing ends up in `self.burst_stats`
+        """
+        saved = ZERO
+        started = ticks_ms()
+        for index in range(frames):
+            frame_started = ticks_ms()
+            if not await self.take_photo():
+                break
+            try:
+                is_saved = await save_frame(index)
+            finally:
+                # Let the camera move on to the next frame
+                await self.resume()
+            if not is_saved:
+                break
+            saved += ONE
+            wait_ms = interval_ms - ticks_diff(ticks_ms(), frame_started)
+            if wait_ms > ZERO and index < frames - ONE:
+                await sleep_ms(wait_ms)
+        elapsed = ticks_diff(ticks_ms(), started)
+        self.burst_stats = {
+            'frames': saved,
+            'elapsed_ms': elapsed,
+            'fps': (saved * THOUSAND) / max(elapsed, ONE),
+        }
+        return saved
+
+    async def benchmark_burst(self, frames: int = CAMERA_BURST_FRAMES, on_chunk: Optional[Callable] = None) -> dict:
+        """
+        Highest achievable frames/sec at each image size: a back-to-back burst
+        (no interval) per size, with chunks handed to `on_chunk` (discarded by default).
+        The previous image size is restored afterwards.
+
+        :returns dict: Image size -> burst stats
+        """
+        consume = on_chunk or (lambda view: None)
+        previous_size = self.image_size
+        report = {}
+
+        async def read_frame(index):
+            return await self.read_chunks(await self.get_buffer_length(), consume)
+
+        for size in (CAMERA_SIZE_640X480, CAMERA_SIZE_320X240, CAMERA_SIZE_160X120):
+            if not await self.set_image_size(size):
+                continue
+            await self.capture_burst(frames, ZERO, read_frame)
+            report[size] = self.burst_stats
+        if previous_size is not None:
+            await self.set_image_size(previous_size)
+        return report
+
+    async def read_photo_into_buffer(self) -> Optional[bytearray]:
+        """
+        Sizes a single bytearray from the frame length up front & fills it in place,
+        so the JPEG is never held as a list of ints.
+        Peak heap use for the capture is available via `self.heap.peak_delta()`
+        """
+        self.heap.reset()
+        buffer_length = await self.get_buffer_length()
+        if not buffer_length:
+            return None
+        photo = bytearray(buffer_length)
+        self.heap.sample()
+        if not await self.read_buffer_into(photo):
+            return None
+        return photo
+
+    async def read_buffer_into(self, photo: bytearray) -> bool:
+        """
+        Fill `photo` straight from the UART via memoryview slices.
+        Only the 5-byte reply header is read separately, into a reused buffer.
+        """
+        return await self._transfer(len(photo), photo=memoryview(photo))
+
+    async def read_chunks(self, buffer_length: int, on_chunk: Callable) -> bool:
+        """
+        Stream the frame buffer in chunks of up to `INC` bytes, calling `on_chunk(memoryview)`
+        for each one. The same chunk buffer is reused throughout, so peak memory is one chunk
+        regardless of resolution. `on_chunk` must consume the view before returning.
+
+        >>> with open('photo.jpg', 'wb') as f:
+        >>>     await camera.read_chunks(await camera.get_buffer_length(), f.write)
+        """
+        self.heap.reset()
+        if self._chunk is None:
+            self._chunk = bytearray(INC)
+        return await self._transfer(buffer_length, on_chunk=on_chunk)
+
+    async def _transfer(self, buffer_length: int, photo: Optional[memoryview] = None,
+                        on_chunk: Optional[Callable] = None) -> bool:
+        """
+        Read the frame buffer either into `photo` or, one chunk at a time, into `self._chunk`.
+        Chunk sizing & retries are left to `self.transfer`, the stats for this read
+        end up in `self.transfer.stats`.
+        """
+        transfer = self.transfer.start(buffer_length)
+        chunk_view = None if photo is not None else memoryview(self._chunk)
+        addr = 0
         while addr < buffer_length:
-            # on the last read, we may need to read fewer bytes.
-            chunk = min(buffer_length - addr, inc)
-            # append 4 bytes that specify the offset into the frame buffer
-            offset = [(addr >> 24) & 0xff,
-                      (addr >> 16) & 0xff,
-                      (addr >> 8) & 0xff,
-                      addr & 0xff]
-            data_to_read = [(chunk >> 24) & 0xff,
-                            (chunk >> 16) & 0xff,
-                            (chunk >> 8) & 0xff,
-                            chunk & 0xff]
-            # Piece it all together & write back
-            self.write(
-                read_photo_command + offset + data_to_read + [ONE, ZERO]
-            )
-            # the reply is a 5-byte header, followed by the image data
-            #   followed by the 5-byte header again.
-            reply = list(self.read(FIVE + chunk + FIVE))
-            if len(reply) != FIVE + chunk + FIVE:
-                # retry the read if we didn't get enough bytes back.
+            chunk = transfer.next_chunk(buffer_length - addr)
+            view = photo[addr:addr + chunk] if photo is not None else chunk_view[:chunk]
+            if await self._read_chunk_into(addr, view) != chunk:
+                # Short or corrupt reply, drop whatever is left on the line & retry this offset
+                if not transfer.on_failure():
+                    print('Giving up on photo at offset', addr)
+                    transfer.finish(False)
+                    return False
+                await self.flush_input()
+                await sleep_ms(transfer.backoff_ms())
                 continue
-            if not check_reply(reply, READ_BUFF):
-                print('ERROR READING PHOTO =(')
-                return None
-            # append the data between the header data to photo
-            photo += reply[FIVE:chunk + FIVE]
-            # advance the offset into the frame buffer
+            transfer.on_success(chunk)
+            if on_chunk is not None:
+                on_chunk(view)
             addr += chunk
-        return photo
+        transfer.finish(True)
+        return True
+
+    async def _read_chunk_into(self, addr: int, view: memoryview) -> int:
+        """
+        Request `len(view)` bytes of the frame buffer at `addr` & read them into `view`
+        :returns int: Number of image bytes received, or -1 if either reply header is corrupt
+        """
+        header = self._header
+        n_bytes = len(view)
+        await self.write(self._build_read_command(addr, n_bytes))
+        # the reply is a 5-byte header, followed by the image data
+        #   followed by the 5-byte header again.
+        if await self.read_into(header) != FIVE:
+            return ZERO
+        if not check_reply(header, READ_BUFF):
+            return -1
+        received = await self.read_into(view, self.transfer_timeout_ms(n_bytes))
+        if await self.read_into(header) != FIVE or not check_reply(header, READ_BUFF):
+            return -1
+        self.heap.sample()
+        return received
 
-    def reset(self)-> bool:
+    def _build_read_command(self, addr: int, chunk: int) -> bytearray:
+        command = self._read_command
+        for i in range(FOUR):
+            shift = 24 - (i * 8)
+            command[_READ_ADDR_INDEX + i] = (addr >> shift) & 0xff
+            command[_READ_LEN_INDEX + i] = (chunk >> shift) & 0xff
+        return command
+
+    async def reset(self) -> bool:
         try:
-            self.write(reset_command)
-            return check_reply(
-                list(self.read(100)),
-                RESET
-            )
-        except:
-            print('Camera reset failed silently')
+            await self.write(reset_command)
+            is_reset = check_reply(await self.read(FIVE), RESET)
+            # The camera prints its boot banner after the reply, throw it away
+            await self.flush_input()
+            # Chip registers & downsizing don't survive a reset
+            self.compression = None
+            self.image_size = None
+            self._motion_count = ZERO
+            self.motion_enabled = False
+            return is_reset
+        except Exception as err:
+            print('Camera reset failed silently', err)
             return False
 
-    def get_buffer_length(self) -> int:
-        self.write(get_buffer_len_command)
-        reply: List[int] = list(self.read(9))
-        if check_reply(reply, GET_BUFF_LEN) and reply[4] == chr(0x4):
+    async def get_buffer_length(self) -> int:
+        await self.write(get_buffer_len_command)
+        reply = await self.read(9)
+        if check_reply(reply, GET_BUFF_LEN) and len(reply) == 9 and reply[4] == FOUR:
             target_bytes = (reply[6], reply[7], reply[8])
             buffer_len = reply[5]
             for target_byte in target_bytes:
@@ -117,18 +548,95 @@ class Camera:
             return buffer_len
         return 0
 
-    def write(self, command: List[int]) -> Optional[int]:
-        return self.serial.write(
-            bytearray(command)
-        )
+    def transfer_timeout_ms(self, n_bytes: int) -> int:
+        """
+        Time to wait for `n_bytes` at the current baud rate (10 bits per byte on the wire)
+        """
+        return CAMERA_COMMAND_TIMEOUT_MS + (n_bytes * 10 * THOUSAND) // self.baudrate
+
+    async def write(self, command: Union[List[int], bytearray]):
+        if isinstance(command, list):
+            command = bytearray(command)
+        self.writer.write(command)
+        await self.writer.drain()
+
+    async def read(self, n_bytes=5, timeout_ms: int = CAMERA_COMMAND_TIMEOUT_MS) -> Optional[bytes]:
+        try:
+            return await wait_for_ms(self.reader.readexactly(n_bytes), timeout_ms)
+        except TimeoutError:
+            return None
+
+    async def read_into(self, buf, timeout_ms: int = CAMERA_COMMAND_TIMEOUT_MS) -> int:
+        """
+        Read until `buf` is full or `timeout_ms` elapses.
+        :returns int: Number of bytes read
+        """
+        # Slicing a bytearray copies it, slicing a memoryview doesn't
+        view = memoryview(buf)
+        n_bytes = len(view)
+        received = 0
+        deadline = ticks_add(ticks_ms(), timeout_ms)
+        while received < n_bytes:
+            remaining_ms = ticks_diff(deadline, ticks_ms())
+            if remaining_ms <= ZERO:
+                break
+            try:
+                count = await wait_for_ms(self._read_some(view[received:]), remaining_ms)
+            except TimeoutError:
+                break
+            if not count:
+                break
+            received += count
+        return received
+
+    async def _read_some(self, view: memoryview) -> int:
+        # Stream.readinto only exists on newer uasyncio builds
+        if hasattr(self.reader, 'readinto'):
+            return await self.reader.readinto(view)
+        data = await self.reader.read(len(view))
+        count = len(data)
+        view[:count] = data
+        return count
+
+    async def flush_input(self, quiet_ms: int = 50):
+        """
+        Discard anything left on the line until it's been quiet for `quiet_ms`
+        """
+        while await self.read(ONE, quiet_ms) is not None:
+            pass
+
+
+def write_data_command(data_type: int, addr: tuple, value: int) -> List[int]:
+    high, low = addr
+    return [SEND, SERIAL_NUM, WRITE_DATA, FIVE, data_type, ONE, high, low, value]
+
+
+def set_port_command(baudrate: int) -> List[int]:
+    high, low = BAUD_RATE_DIVIDERS[baudrate]
+    return [SEND, SERIAL_NUM, SET_PORT, THREE, ONE, high, low]
+
+
+def load_baudrate(file_path: str = CAMERA_BAUD_FILE) -> Optional[int]:
+    try:
+        with open(file_path, 'r') as f:
+            baudrate = int(f.read().strip())
+    except (OSError, ValueError):
+        return None
+    return baudrate if baudrate in BAUD_RATE_DIVIDERS else None
+
 
-    def read(self, n_bytes=5) -> Optional[bytes]:
-        return self.serial.read(n_bytes)
+def save_baudrate(baudrate: int, file_path: str = CAMERA_BAUD_FILE):
+    if load_baudrate(file_path) == baudrate:
+        return
+    with BufferedWriter(file_path, 'wb') as f:
+        f.write(str(baudrate))
 
 
-def check_reply(reply: List[int], byte_num: int) -> bool:
+def check_reply(reply: Union[bytes, bytearray, List[int], None], byte_num: int) -> bool:
     return (
-            REPLY == reply[0]
+            reply is not None
+            and len(reply) >= FOUR
+            and REPLY == reply[0]
             and SERIAL_NUM == reply[1]
             and byte_num == reply[2]
             and 0x00 == reply[3]
@@ -0,0 +1,94 @@
+"""
+Adaptive chunk sizing for VC0706 frame buffer reads.
+
+Long chunks are the fastest way to move a frame, but a single dropped byte costs
+the whole chunk. The controller halves the chunk after a short or corrupt reply,
+doubles it again after a run of clean ones, and caps the retries for any one offset.
+"""
+from micropython import const
+from utime import ticks_diff, ticks_ms
+
+from constants import ZERO, ONE, TWO, THOUSAND
+from settings import (
+    CAMERA_MAX_CHUNK, CAMERA_MIN_CHUNK, CAMERA_MAX_RETRIES, CAMERA_GROW_AFTER, CAMERA_RETRY_BACKOFF_MS
+)
+
+
+_MAX_HISTORY = const(32)
+
+
+class TransferController:
+    """
+    >>> transfer = TransferController()
+    >>> transfer.start(buffer_length)
+    >>> chunk = transfer.next_chunk(buffer_length - addr)
+    >>> # ... read the chunk ...
+    >>> transfer.on_success(chunk)  # or `if not transfer.on_failure(): give up`
+    >>> transfer.finish(True)
+    >>> transfer.stats  # {'bytes': ..., 'bytes_per_sec': ..., 'retries': ..., 'chunk_history': [...]}
+    """
+    def __init__(self, max_chunk: int = CAMERA_MAX_CHUNK, min_chunk: int = CAMERA_MIN_CHUNK,
+                 max_retries: int = CAMERA_MAX_RETRIES, grow_after: int = CAMERA_GROW_AFTER):
+        self.max_chunk = max_chunk
+        self.min_chunk = min_chunk
+        self.max_retries = max_retries
+        self.grow_after = grow_after
+        # The chunk size carries over between transfers, so each board settles on what its line can do
+        self.chunk_size = max_chunk
+        self.stats = {}
+        self._clean = ZERO
+        self._offset_retries = ZERO
+        self._started = ZERO
+        self._bytes = ZERO
+        self._retries = ZERO
+        self._history = []
+
+    def start(self, buffer_length: int):
+        self._clean = ZERO
+        self._offset_retries = ZERO
+        self._started = ticks_ms()
+        self._bytes = ZERO
+        self._retries = ZERO
+        self._history = [self.chunk_size]
+        self.stats = {'buffer_length': buffer_length}
+        return self
+
+    def next_chunk(self, remaining: int) -> int:
+        return min(remaining, self.chunk_size)
+
+    def on_success(self, n_bytes: int):
+        self._bytes += n_bytes
+        self._offset_retries = ZERO
+        self._clean += ONE
+        if self._clean >= self.grow_after and self.chunk_size < self.max_chunk:
+            self._resize(min(self.max_chunk, self.chunk_size * TWO))
+
+    def on_failure(self) -> bool:
+        """
+        :returns bool: True if the current offset should be retried, False once the retry cap is hit
+        """
+        self._retries += ONE
+        self._offset_retries += ONE
+        if self.chunk_size > self.min_chunk:
+            self._resize(max(self.min_chunk, self.chunk_size // TWO))
+        return self._offset_retries <= self.max_retries
+
+    def backoff_ms(self) -> int:
+        return CAMERA_RETRY_BACKOFF_MS << (self._offset_retries - ONE)
+
+    def finish(self, is_complete: bool) -> dict:
+        elapsed = ticks_diff(ticks_ms(), self._started)
+        stats = self.stats
+        stats['complete'] = is_complete
+        stats['bytes'] = self._bytes
+        stats['elapsed_ms'] = elapsed
+        stats['bytes_per_sec'] = (self._bytes * THOUSAND) // max(elapsed, ONE)
+        stats['retries'] = self._retries
+        stats['chunk_history'] = self._history
+        return stats
+
+    def _resize(self, chunk_size: int):
+        self._clean = ZERO
+        self.chunk_size = chunk_size
+        if len(self._history) < _MAX_HISTORY:
+            self._history.append(chunk_size)
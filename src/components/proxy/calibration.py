@@ -0,0 +1,110 @@
+"""
+Piecewise-linear calibration in integer fixed point
+
+A table of (raw reading, calibrated value) points is turned into one line segment per
+pair of neighbouring points, with its slope precomputed in Q16 fixed point. A reading
+is then a binary search for its segment plus one multiply, shift & add, with no floats
+& nothing allocated.
+
+Readings outside the table either clamp to the first/last value, or extrapolate along
+the first/last segment.
+
+Nothing board-specific in here either, so it runs on the host as well
+(see scripts/bench_calibration.py).
+"""
+from array import array
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+try:
+    import ujson as json
+except ImportError:
+    import json
+
+
+FRACTION_BITS = const(16)
+_HALF = const(1 << 15)
+
+
+class Calibration:
+    """
+    >>> table = ((34524, 0), (84468, 305), (164566, 610))
+    >>> calibration = Calibration(table)
+    >>> calibration.convert(59496)  # 152
+    >>> calibration.convert(10)  # 0, clamped
+    >>> Calibration(table, extrapolate=True).convert(10)  # -211
+    """
+    def __init__(self, points, extrapolate: bool = False):
+        points = sorted(points)
+        if len(points) < 2:
+            raise ValueError('A calibration needs at least 2 points')
+        self.extrapolate = extrapolate
+        self._raws = array('i', [raw for raw, _ in points])
+        self._values = array('i', [value for _, value in points])
+        self._slopes = array('i', [0] * (len(points) - 1))
+        for i in range(len(points) - 1):
+            raw_diff = points[i + 1][0] - points[i][0]
+            if raw_diff <= 0:
+                raise ValueError('Calibration points need distinct raw values')
+            value_diff = (points[i + 1][1] - points[i][1]) << FRACTION_BITS
+            # Rounded, a truncated slope drifts low along long segments
+            self._slopes[i] = (value_diff + raw_diff // 2) // raw_diff
+
+    def __len__(self) -> int:
+        return len(self._raws)
+
+    def convert(self, raw: int) -> int:
+        raws = self._raws
+        last = len(raws) - 1
+        if raw <= raws[0]:
+            if not self.extrapolate:
+                return self._values[0]
+            segment = 0
+        elif raw >= raws[last]:
+            if not self.extrapolate:
+                return self._values[last]
+            segment = last - 1
+        else:
+            segment = self._segment(raw)
+        return self._values[segment] + (((raw - raws[segment]) * self._slopes[segment] + _HALF) >> FRACTION_BITS)
+
+    def _segment(self, raw: int) -> int:
+        """
+        Binary search for the segment that starts at or below `raw`
+        """
+        raws = self._raws
+        low = 0
+        high = len(raws) - 1
+        while high - low > 1:
+            middle = (low + high) // 2
+            if raws[middle] <= raw:
+                low = middle
+            else:
+                high = middle
+        return low
+
+
+def load_calibration(path: str, default, extrapolate: bool = False) -> Calibration:
+    """
+    Load a calibration table from a JSON settings file:
+
+        {"points": [[34524, 0], [84468, 305], ...], "extrapolate": false}
+
+    Falls back to `default` (a sequence of (raw, value) points) if there's no file,
+    or it doesn't hold a usable table.
+    """
+    try:
+        with open(path) as f:
+            table = json.load(f)
+        return Calibration(
+            [(int(raw), int(value)) for raw, value in table['points']],
+            table.get('extrapolate', extrapolate)
+        )
+    except (OSError, ValueError, KeyError, TypeError) as err:
+        if not isinstance(err, OSError):
+            print('Bad calibration file, using the default', path, err)
+        return Calibration(default, extrapolate)
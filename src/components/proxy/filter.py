@@ -0,0 +1,152 @@
+"""
+Proximity filter, turns noisy distance readings into approach events
+
+    reading -> range check -> outlier rejection -> median window -> EMA -> hysteresis + dwell
+
+- Readings outside the sensor's range (timeouts, False, negative pulses) are counted & skipped
+- A reading too far from the window's median is an outlier, unless enough of them
+  in a row say the scene really changed
+- An approach is only reported once the smoothed distance has stayed inside `enter_cm`
+  for `dwell_ms`, & it has to back off past `exit_cm` before another one can happen
+
+Everything is preallocated & there's nothing board-specific in here, so it runs
+unchanged on the host (see scripts/replay_proximity.py).
+"""
+from array import array
+
+try:
+    from micropython import const
+except ImportError:
+    def const(value):
+        return value
+
+try:
+    from utime import ticks_diff
+except ImportError:
+    def ticks_diff(end, start):
+        return end - start
+
+
+ABSENT = const(0)
+# Inside enter_cm, waiting out the dwell time
+APPROACHING = const(1)
+PRESENT = const(2)
+
+
+class ProximityFilter:
+    """
+    >>> proximity = ProximityFilter(enter_cm=PROXY_DISTANCE_THRESHOLD_CM)
+    >>> if proximity.update(await proxy.async_get_distance(), ticks_ms()):
+    >>>     await take_photo()
+    >>> proximity.distance  # Smoothed distance, None until the first valid reading
+    >>> proximity.stats  # {'samples', 'invalid', 'outliers', 'triggers'}
+    """
+    def __init__(self, enter_cm: float, exit_cm: float = None, window: int = 5, alpha: float = 0.4,
+                 dwell_ms: int = 300, max_jump_cm: float = 100, min_cm: float = 2, max_cm: float = 400):
+        exit_cm = exit_cm if exit_cm is not None else enter_cm
+        if not enter_cm <= exit_cm < max_cm:
+            # Every valid reading would be inside, so an approach could never end
+            raise ValueError('Proximity thresholds need enter_cm <= exit_cm < max_cm')
+        self.enter_cm = enter_cm
+        self.exit_cm = exit_cm
+        self.alpha = alpha
+        self.dwell_ms = dwell_ms
+        self.max_jump_cm = max_jump_cm
+        self.min_cm = min_cm
+        self.max_cm = max_cm
+        self.window = window
+        self._readings = array('f', [0] * window)
+        # Scratch space for the median, so sorting doesn't allocate
+        self._sorted = array('f', [0] * window)
+        self._count = 0
+        self._index = 0
+        self._outliers_in_row = 0
+        self._invalid_in_row = 0
+        self.distance = None
+        self.state = ABSENT
+        self._entered_at = 0
+        self.stats = {
+            'samples': 0,
+            'invalid': 0,
+            'outliers': 0,
+            'triggers': 0,
+        }
+
+    def reset(self):
+        self._count = 0
+        self._index = 0
+        self._outliers_in_row = 0
+        self.distance = None
+        self.state = ABSENT
+
+    def update(self, reading, now_ms: int) -> bool:
+        """
+        :param reading: Distance in cm, or False/None when the sensor didn't get one
+        :param now_ms: ticks_ms() of the reading
+        :returns bool: True when this reading completes an approach
+        """
+        stats = self.stats
+        stats['samples'] += 1
+        if reading is None or reading is False or not self.min_cm <= reading <= self.max_cm:
+            stats['invalid'] += 1
+            self._invalid_in_row += 1
+            if self._invalid_in_row >= self.window:
+                # Nothing in range for a whole window, whatever was there is gone
+                self.reset()
+            return False
+        self._invalid_in_row = 0
+        if self._count == self.window and abs(reading - self._median()) > self.max_jump_cm:
+            self._outliers_in_row += 1
+            # A majority of the window disagreeing is a real change, not a glitch
+            if self._outliers_in_row <= self.window // 2:
+                stats['outliers'] += 1
+                return False
+        self._outliers_in_row = 0
+        self._push(reading)
+        median = self._median()
+        if self.distance is None:
+            self.distance = median
+        else:
+            self.distance += self.alpha * (median - self.distance)
+        return self._update_state(now_ms)
+
+    def _update_state(self, now_ms: int) -> bool:
+        distance = self.distance
+        if self.state == PRESENT:
+            if distance > self.exit_cm:
+                self.state = ABSENT
+            return False
+        if distance > self.enter_cm:
+            self.state = ABSENT
+            return False
+        if self.state == ABSENT:
+            self.state = APPROACHING
+            self._entered_at = now_ms
+        if ticks_diff(now_ms, self._entered_at) < self.dwell_ms:
+            return False
+        self.state = PRESENT
+        self.stats['triggers'] += 1
+        return True
+
+    def _push(self, reading: float):
+        self._readings[self._index] = reading
+        self._index = (self._index + 1) % self.window
+        if self._count < self.window:
+            self._count += 1
+
+    def _median(self) -> float:
+        # Insertion sort, the window is only a handful of readings
+        count = self._count
+        ordered = self._sorted
+        readings = self._readings
+        for i in range(count):
+            value = readings[i]
+            j = i - 1
+            while j >= 0 and ordered[j] > value:
+                ordered[j + 1] = ordered[j]
+                j -= 1
+            ordered[j + 1] = value
+        middle = count // 2
+        if count % 2:
+            return ordered[middle]
+        return (ordered[middle - 1] + ordered[middle]) / 2
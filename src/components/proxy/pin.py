@@ -1,20 +1,35 @@
 """
 Source: https://github.com/lemariva/uPySensors/blob/19c5e2a21d61dbb50bf3b1c9032789e816291720/hcsr04.py
+
+`async_get_distance` times the echo with a Pin IRQ on both edges instead of blocking in
+`time_pulse_us`: the handler only stores `ticks_us()` into a preallocated array & sets a
+ThreadSafeFlag, so the event loop keeps running for the whole round trip (up to ~25ms).
 """
+from array import array
 from machine import Pin, time_pulse_us
 from micropython import const
-from uasyncio import sleep
+from uasyncio import TimeoutError, sleep_ms, wait_for_ms
 import utime
 
-from constants import THOUSAND
-from utils.conversions import micro_to_base
-
+from constants import ZERO, ONE, THOUSAND
 
-_DEFAULT_TIMEOUT = const(500 * 2 * 30)
+try:
+    from uasyncio import ThreadSafeFlag
+except ImportError:
+    ThreadSafeFlag = None
 
 
-async def sleep_us(us: float):
-    return await sleep(micro_to_base(us))
+_DEFAULT_TIMEOUT = const(500 * 2 * 30)
+# The HC-SR04 wants ~60ms between pings, or it hears the last one's echo
+_MIN_CYCLE_MS = const(60)
+# Indexes into PinAdapter._edges
+_RISE = const(0)
+_FALL = const(1)
+_STATE = const(2)
+# _edges[_STATE]
+_WAITING = const(0)
+_ROSE = const(1)
+_DONE = const(2)
 
 
 def microsecond_to_cm(delta_microseconds: float) -> float:
@@ -31,15 +46,11 @@ def microsecond_to_cm(delta_microseconds: float) -> float:
     return (delta_microseconds / 2) / 29.1
 
 
-def micro_to_milli(micro):
-    return micro / THOUSAND
-
-
 class PinAdapter:
     """
     Driver to use the ultrasonic sensor HC-SR04.
     The sensor range is between 2cm and 4m.
-    The timeouts received listening to echo pin are converted to OSError('Out of range')
+    Echoes that time out (out of range) come back as False
     """
     stable_us = 5
     echo_us = 10
@@ -48,20 +59,53 @@ class PinAdapter:
     def __init__(self, trigger_pin: Pin, echo_pin: Pin, echo_timeout_us: int = _DEFAULT_TIMEOUT):
         """
         :param trigger_pin: Output pin to send pulses
-        :param echo_pin: (Input/Open-Drain) Receives pulse
+        :param echo_pin: Input, receives the echo pulse
         :param echo_timeout_us: Timeout in microseconds to listen to echo pin.
             Default is based in sensor limit range (4m)
         """
         self.echo_timeout_us = echo_timeout_us
+        self.echo_timeout_ms = echo_timeout_us // THOUSAND + ONE
         # Init trigger pin (out)
         self.trigger = trigger_pin
         self.trigger.init(mode=Pin.OUT)
         self.trigger.value(0)
         # Init echo pin (in)
         self.echo = echo_pin
-        self.echo.init(mode=Pin.OPEN_DRAIN)
-        self.stable_ms = micro_to_milli(self.stable_us)
-        self.echo_ms = micro_to_milli(self.echo_us)
+        self.echo.init(mode=Pin.IN)
+        # Written by the IRQ handler: rise ticks, fall ticks, state
+        self._edges = array('i', [ZERO, ZERO, ZERO])
+        self._flag = ThreadSafeFlag() if ThreadSafeFlag is not None else None
+        self._last_ping = utime.ticks_add(utime.ticks_ms(), -_MIN_CYCLE_MS)
+
+    async def setup(self) -> bool:
+        trigger = Pin.IRQ_RISING | Pin.IRQ_FALLING
+        try:
+            # A hard IRQ keeps the timestamps within a few us of the edges
+            self.echo.irq(handler=self._on_edge, trigger=trigger, hard=True)
+        except TypeError:
+            self.echo.irq(handler=self._on_edge, trigger=trigger)
+        return True
+
+    def _on_edge(self, pin):
+        # Runs in interrupt context, no allocation: small ints into a preallocated array
+        edges = self._edges
+        if pin.value():
+            edges[_RISE] = utime.ticks_us()
+            edges[_STATE] = _ROSE
+        elif edges[_STATE] == _ROSE:
+            edges[_FALL] = utime.ticks_us()
+            edges[_STATE] = _DONE
+            if self._flag is not None:
+                self._flag.set()
+
+    def _trigger(self):
+        self.trigger.value(0)  # Stabilize the sensor
+        utime.sleep_us(self.stable_us)
+        self.trigger.value(1)
+        # Send a 10us pulse.
+        utime.sleep_us(self.echo_us)
+        self.trigger.value(0)
+        self._last_ping = utime.ticks_ms()
 
     def get_pulse_microseconds(self) -> float:
         pulse_us = time_pulse_us(self.echo, self.echo_timeout_us)
@@ -71,32 +115,46 @@ class PinAdapter:
 
     def _send_pulse_and_wait(self) -> float:
         """
-        Send the pulse to trigger and listen on echo pin.
-        We use the method `pulses_get()` to get the microseconds until the echo is received.
+        Send the pulse to trigger and listen on echo pin (blocking).
+        We use the method `time_pulse_us()` to get the microseconds until the echo is received.
         """
-        self.trigger.value(0)  # Stabilize the sensor
-        utime.sleep_ms(self.stable_ms)
-        self.trigger.value(1)
-        # Send a 10us pulse.
-        utime.sleep_ms(self.echo_ms)
-        self.trigger.value(0)
+        self._trigger()
         return self.get_pulse_microseconds()
 
     async def _async_send_pulse_and_wait(self):
         """
-        Same as _send_pulse_and_wait, but async
+        Same as _send_pulse_and_wait, but the IRQ handler times the echo
+        :returns int|None: Pulse length in microseconds, None if it timed out
         """
-        self.trigger.value(0)
-        await sleep_us(self.stable_us)
-        self.trigger.value(1)
-        await sleep_us(self.echo_us)
-        self.trigger.value(0)
-        return self.get_pulse_microseconds()
+        wait_ms = _MIN_CYCLE_MS - utime.ticks_diff(utime.ticks_ms(), self._last_ping)
+        if wait_ms > ZERO:
+            await sleep_ms(wait_ms)
+        edges = self._edges
+        edges[_STATE] = _WAITING
+        self._trigger()
+        try:
+            await wait_for_ms(self._wait_for_echo(), self.echo_timeout_ms)
+        except TimeoutError:
+            return None
+        return utime.ticks_diff(edges[_FALL], edges[_RISE])
+
+    async def _wait_for_echo(self):
+        if self._flag is None:
+            # Older firmware without ThreadSafeFlag, poll the handler's state instead
+            while self._edges[_STATE] != _DONE:
+                await sleep_ms(ONE)
+            return
+        while self._edges[_STATE] != _DONE:
+            await self._flag.wait()
 
     def get_distance(self) -> float:
         pulse_time = self._send_pulse_and_wait()
+        if pulse_time < 0:
+            return False
         return microsecond_to_cm(pulse_time)
 
     async def async_get_distance(self):
         pulse_time = await self._async_send_pulse_and_wait()
+        if pulse_time is None:
+            return False
         return microsecond_to_cm(pulse_time)
@@ -3,11 +3,17 @@ Adapter for Sparkfun QWIIC HC-SR04 breakout
 Adapted from source code here: https://github.com/sparkfun/Zio-Qwiic-Ultrasonic-Distance-Sensor
 Product Page: https://www.sparkfun.com/products/17777
 
+Raw readings are mapped to millimeters by a piecewise-linear Calibration (VALUE_MM_MAPPING,
+or the table in PROXY_CALIBRATION_FILE), & reported in centimeters like the PinAdapter.
 """
 from micropython import const
 import uasyncio
+from utime import sleep_ms
 
-from utils.math_utils import scale
+from constants import FIVE, TEN
+from settings import PROXY_CALIBRATION_FILE, PROXY_CALIBRATION_EXTRAPOLATE
+from utils.type_conversions import bytes_to_int
+from .calibration import Calibration, load_calibration
 
 
 DEFAULT_ADDRESS = const(0x00)
@@ -15,6 +21,19 @@ OTHER_ADDRESS = const(0x08)
 ADDRESS_OPTIONS = [DEFAULT_ADDRESS, OTHER_ADDRESS]
 SLEEP = const(5)
 
+VALUE_MM_MAPPING = (
+    # (i2c_value, actual_distance_mm)
+    (34524, 0),
+    (84468, 305),
+    (164566, 610),
+    (249584, 914),
+    (324421, 1219),
+    (432534, 1524),
+    (506467, 1829),
+    (596762, 2134)
+)
+DEFAULT_CALIBRATION = Calibration(VALUE_MM_MAPPING)
+
 
 class QwiicAdapter:
     """
@@ -22,8 +41,8 @@ class QwiicAdapter:
     >>> iic = I2C(0, sda=Pin(23), scl=Pin(22))
     >>> proxy = QwiicProxy(iic)
     >>> raw_distance = proxy.read() # b'\x00\xed'
-    >>> project_distance(raw_distance) # 60909
-    >>> proxy.get_distance()  # 60909
+    >>> project_distance(raw_distance) # 161 (mm)
+    >>> proxy.get_distance()  # 16 (cm)
     """
 
     def __init__(self, iic, address=DEFAULT_ADDRESS):
@@ -31,6 +50,11 @@ class QwiicAdapter:
         self.address = address
         self.is_ready = False
         self.distance = 0
+        self.calibration = load_calibration(
+            PROXY_CALIBRATION_FILE,
+            VALUE_MM_MAPPING,
+            PROXY_CALIBRATION_EXTRAPOLATE
+        )
         addresses = iic.scan()
         for option in addresses:
             if option in ADDRESS_OPTIONS:
@@ -38,7 +62,7 @@ class QwiicAdapter:
 
     async def setup(self):
         self.is_ready = True
-        return ready
+        return self.is_ready
 
     def read(self, n_bytes: int = 2) -> bytes:
         """
@@ -58,30 +82,26 @@ class QwiicAdapter:
     def get_distance(self, n_bytes=2):
         self.write(0x01)
         sleep_ms(SLEEP)
-        distance = project_distance(self.read(n_bytes))
-        self.distance = distance
-        return distance
+        return self._update(self.read(n_bytes))
 
     async def async_get_distance(self, n_bytes=2):
         self.write(0x01)
         await uasyncio.sleep_ms(SLEEP)
-        distance = project_distance(self.read(n_bytes))
-        self.distance = distance
-        return distance
+        return self._update(self.read(n_bytes))
+
+    def _update(self, iic_value: bytes) -> int:
+        # Millimeters -> centimeters, rounded
+        self.distance = (project_distance(iic_value, self.calibration) + FIVE) // TEN
+        return self.distance
 
 
-def project_distance(iic_value: bytes) -> int:
-    measured = parse(iic_value)
-    last_pair = (0, 0)
-    for proxy, mm in VALUE_MM_MAPPING:
-        last_proxy, last_mm = last_pair
-        if last_proxy <= measured <= proxy_value:
-            # If the proxy distance given is somewhere between the last loop and the current
-            # loop, scale it based on the respective min & maxes
-            scale_value = scale(last_proxy, proxy, last_mm, mm)
-            return scale_value(measured)
-        last_pair = (proxy, mm)
-    return 0
+def project_distance(iic_value: bytes, calibration: Calibration = None) -> int:
+    """
+    :returns int: Distance in millimeters
+    """
+    if calibration is None:
+        calibration = DEFAULT_CALIBRATION
+    return calibration.convert(parse(iic_value))
 
 
 def parse(iic_value: bytes) -> int:
@@ -90,18 +110,6 @@ def parse(iic_value: bytes) -> int:
     return left | iic_int
 
 
-VALUE_MM_MAPPING = (
-    # (i2c_value, actual_distance_mm)
-    (34524, 0),
-    (84468, 305),
-    (164566, 610),
-    (249584, 914),
-    (324421, 1219),
-    (432534, 1524),
-    (506467, 1829),
-    (596762, 2134)
-)
-
 # Testing
 # ############
 # from micropython import const
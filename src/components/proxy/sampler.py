@@ -0,0 +1,176 @@
+"""
+Background sampling for the proximity sensor
+
+Reads the proxy at a fixed rate in its own task, so readings keep coming while the
+app is busy capturing, & runs them through the ProximityFilter. The app loop only
+looks at the latest result, it never waits on the sensor.
+"""
+from micropython import const
+from uasyncio import Event, sleep_ms
+from utime import ticks_add, ticks_diff, ticks_ms
+
+from constants import ZERO, ONE, TEN, THOUSAND
+from .filter import APPROACHING
+
+
+# Achieved rate is worked out over windows this long
+_RATE_WINDOW_MS = const(10 * THOUSAND)
+_MINUTE_MS = const(60 * THOUSAND)
+
+
+class ProxySampler:
+    """
+    >>> sampler = ProxySampler(proxy.async_get_distance, ProximityFilter(PROXY_DISTANCE_THRESHOLD_CM))
+    >>> app.start_task(sampler.run())
+    >>> sampler.distance, sampler.updated_ms  # Latest filtered distance (cm) & its ticks_ms()
+    >>> if sampler.take_approach():
+    >>>     await take_photo()
+    >>> sampler.stats  # {'samples', 'invalid', 'errors', 'missed', 'jitter_ms', 'max_jitter_ms', ...}
+    """
+    def __init__(self, read, proximity, interval_ms: int = 60, on_change=None, change_cm: float = 20,
+                 on_error=None):
+        """
+        :param read: async callable, returns a distance in cm or False
+        :param proximity: ProximityFilter the readings go through
+        :param interval_ms: Time between readings, can be changed while running
+        :param on_change: Called with no arguments when a reading lands more than `change_cm`
+            from the filtered distance, or while something is approaching
+        :param on_error: Called with the exception when a sample raises, sampling carries on
+        """
+        self.read = read
+        self.proximity = proximity
+        self.interval_ms = interval_ms
+        self.on_change = on_change
+        self.change_cm = change_cm
+        self.on_error = on_error
+        self.run_sampler = True
+        # Latest reading as it came from the sensor, False when it failed
+        self.reading = False
+        self.updated_ms = ticks_ms()
+        # Set by an approach, until the app takes it
+        self.approach = Event()
+        # Cleared while paused, e.g. while the camera's motion engine does the watching
+        self.active = Event()
+        self.active.set()
+        self._jitter_total = ZERO
+        self._rate_samples = ZERO
+        self._rate_started = ticks_ms()
+        self.stats = {
+            'samples': ZERO,
+            'invalid': ZERO,
+            # Samples that raised, see `on_error`
+            'errors': ZERO,
+            'approaches': ZERO,
+            # Readings skipped because the last one ran over its slot
+            'missed': ZERO,
+            'jitter_ms': ZERO,
+            'max_jitter_ms': ZERO,
+            'mean_jitter_ms': ZERO,
+            'samples_per_min': ZERO,
+        }
+
+    @property
+    def distance(self):
+        """
+        Filtered distance in cm, None until there's been a valid reading
+        """
+        return self.proximity.distance
+
+    def age_ms(self) -> int:
+        return ticks_diff(ticks_ms(), self.updated_ms)
+
+    def take_approach(self) -> bool:
+        """
+        :returns bool: True once per approach the filter reported
+        """
+        if not self.approach.is_set():
+            return False
+        self.approach.clear()
+        return True
+
+    def stop(self):
+        self.run_sampler = False
+        self.active.set()
+
+    def pause(self):
+        """
+        Stop reading the proxy until `resume`. Whatever the filter saw so far is dropped,
+        it'll be stale by then
+        """
+        if not self.active.is_set():
+            return
+        self.active.clear()
+        self.approach.clear()
+        self.proximity.reset()
+
+    def resume(self):
+        self.active.set()
+
+    async def run(self):
+        due = ticks_ms()
+        while self.run_sampler:
+            if not self.active.is_set():
+                await self.active.wait()
+                due = ticks_ms()
+            now = ticks_ms()
+            late = ticks_diff(now, due)
+            if late >= self.interval_ms:
+                # Ran over by more than a whole slot, start again from now instead of
+                # firing a burst of readings to catch up
+                self.stats['missed'] += late // self.interval_ms
+                due = now
+                late = ZERO
+            try:
+                await self.sample(late)
+            except Exception as err:
+                # Nothing restarts this task, one bad sample mustn't end it
+                self.stats['errors'] += ONE
+                if self.on_error is not None:
+                    self.on_error(err)
+            due = ticks_add(due, self.interval_ms)
+            wait_ms = ticks_diff(due, ticks_ms())
+            if wait_ms > ZERO:
+                await sleep_ms(wait_ms)
+
+    async def sample(self, late_ms: int = ZERO):
+        stats = self.stats
+        reading = await self.read()
+        now = ticks_ms()
+        self.reading = reading
+        self.updated_ms = now
+        stats['samples'] += ONE
+        if reading is False or reading is None:
+            stats['invalid'] += ONE
+        elif self.on_change is not None and self._is_changing(reading):
+            self.on_change()
+        if self.proximity.update(reading, now):
+            stats['approaches'] += ONE
+            self.approach.set()
+        self._update_jitter(late_ms)
+        self._update_rate(now)
+
+    def _is_changing(self, reading) -> bool:
+        proximity = self.proximity
+        if proximity.state == APPROACHING:
+            return True
+        # Compared to the filtered distance, before this reading goes in, so a jump the
+        # filter rejects as an outlier still counts
+        return proximity.distance is not None and abs(reading - proximity.distance) > self.change_cm
+
+    def _update_jitter(self, late_ms: int):
+        stats = self.stats
+        stats['jitter_ms'] = late_ms
+        if late_ms > stats['max_jitter_ms']:
+            stats['max_jitter_ms'] = late_ms
+        self._jitter_total += late_ms
+        # Tenths of a ms, so a mean under 1ms still shows
+        stats['mean_jitter_ms'] = self._jitter_total * TEN // stats['samples'] / TEN
+
+    def _update_rate(self, now: int):
+        self._rate_samples += ONE
+        elapsed = ticks_diff(now, self._rate_started)
+        if elapsed < _RATE_WINDOW_MS:
+            return
+        self.stats['samples_per_min'] = self._rate_samples * _MINUTE_MS // elapsed
+        self._rate_samples = ZERO
+        self._rate_started = now
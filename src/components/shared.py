@@ -1,6 +1,8 @@
 from machine import Pin, I2C, UART
 from constants import ZERO, ONE, TWO
-from settings import SDA, SCL, TX, RX, RED_LED, GREEN_LED, BLUE_LED, UART_BAUDRATE, SLEEP_DURATION_MS
+from settings import (
+    SDA, SCL, TX, RX, RED_LED, GREEN_LED, BLUE_LED, UART_BAUDRATE, UART_RX_BUFFER, SLEEP_DURATION_MS
+)
 
 
 class Buses:
@@ -8,7 +10,7 @@ class Buses:
         sda = Pin(SDA)
         scl = Pin(SCL)
         self.iic = I2C(0, sda=sda, scl=scl)
-        self.uart = UART(ONE, UART_BAUDRATE)
+        self.uart = UART(ONE, UART_BAUDRATE, tx=TX, rx=RX, rxbuf=UART_RX_BUFFER)
 
 
 class AppInterface:
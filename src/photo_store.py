@@ -0,0 +1,394 @@
+"""
+Photo storage on the board's flash
+
+Photos live in `PHOTO_DIR` under a byte quota (`PHOTO_QUOTA_BYTES`), the oldest are evicted
+first to make room. Rather than listing/stat-ing the directory, the store keeps an append-only
+binary manifest of fixed-size records:
+
+    kind (B) | photo id (I) | timestamp (I) | size (I) | crc32 (I)
+
+Replaying the manifest at startup rebuilds a compact, id-ordered index (arrays, not objects),
+so the oldest photo is O(1) & any photo is found by binary search.
+Uploads & evictions are recorded by appending more records; the manifest is rewritten
+once dead records outnumber live ones.
+"""
+from array import array
+from os import mkdir, remove, rename, stat
+from ubinascii import crc32
+from ustruct import calcsize, pack, pack_into, unpack_from
+from utime import time
+from micropython import const
+from typing import Iterator, Optional
+
+from constants import ZERO, ONE, TWO
+from settings import FLASH_BLOCK_SIZE, PHOTO_DIR, PHOTO_QUOTA_BYTES
+from utils.buffered_writer import BufferedWriter, SYNC_ON_CLOSE, sync
+
+
+JPEG_EOI = b'\xff\xd9'
+
+RECORD_FORMAT = '<BIIII'
+RECORD_SIZE = calcsize(RECORD_FORMAT)
+RECORD_ADD = const(1)
+RECORD_UPLOADED = const(2)
+RECORD_REMOVED = const(3)
+
+FLAG_UPLOADED = const(1)
+FLAG_REMOVED = const(2)
+
+# Don't bother compacting the manifest/index until there's at least this much dead weight
+_MIN_COMPACT = const(32)
+
+
+class PhotoWriter:
+    """
+    File-like target for `Camera.read_chunks`, keeps a running size & CRC of what was written
+    """
+    def __init__(self, path: str, timestamp: int, expected_length: int, buffer: bytearray = None):
+        self.path = path
+        self.timestamp = timestamp
+        self.expected_length = expected_length
+        self.size = ZERO
+        self.crc = ZERO
+        # Camera chunks are block multiples, so these mostly go straight through without a copy
+        self.file = BufferedWriter(path, 'wb', sync_policy=SYNC_ON_CLOSE, buffer=buffer)
+
+    def write(self, chunk) -> int:
+        self.file.write(chunk)
+        self.crc = crc32(chunk, self.crc)
+        self.size += len(chunk)
+        return len(chunk)
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class PhotoStore:
+    """
+    >>> store = PhotoStore().load()
+    >>> writer = store.open_writer(buffer_length)
+    >>> await camera.read_chunks(buffer_length, writer.write)
+    >>> photo_id = store.commit(writer)  # None if the photo didn't verify
+    >>> for photo_id in store.pending():
+    >>>     upload(store.path(photo_id))
+    >>>     store.mark_uploaded(photo_id)
+    """
+    def __init__(self, directory: str = PHOTO_DIR, quota_bytes: int = PHOTO_QUOTA_BYTES):
+        self.directory = directory
+        self.quota_bytes = quota_bytes
+        self.manifest_path = directory + '/manifest.bin'
+        self.temp_path = directory + '/incoming.tmp'
+        self.total_bytes = ZERO
+        self.next_id = ONE
+        self._record = bytearray(RECORD_SIZE)
+        self._dead = ZERO
+        # Only one photo is written at a time, so every PhotoWriter shares this buffer.
+        # Manifest compaction borrows it too, but only while no writer is open
+        self._write_buffer = bytearray(FLASH_BLOCK_SIZE)
+        self._open_writer = None
+        # Opened on the first manifest write & kept open, see `_write_record`
+        self._manifest = None
+        self._reset_index()
+
+    def _reset_index(self):
+        # Parallel columns, ordered by id (which is also capture order). Entries before
+        # `_head` have been evicted & are trimmed off in `_compact_index`
+        self._ids = array('I')
+        self._stamps = array('I')
+        self._sizes = array('I')
+        self._crcs = array('I')
+        self._flags = bytearray()
+        self._head = ZERO
+
+    def __len__(self) -> int:
+        return len(self._ids) - self._head
+
+    # Startup
+    # ##############
+    def load(self):
+        """
+        Rebuild the index from the manifest & clear out a half-written photo if there is one
+        """
+        try:
+            mkdir(self.directory)
+        except OSError:
+            pass
+        try:
+            remove(self.temp_path)
+        except OSError:
+            pass
+        self._reset_index()
+        self.total_bytes = ZERO
+        self._dead = ZERO
+        try:
+            manifest = open(self.manifest_path, 'rb')
+        except OSError:
+            return self
+        record = self._record
+        with manifest:
+            while manifest.readinto(record) == RECORD_SIZE:
+                self._replay(record)
+        self._skip_removed()
+        return self
+
+    def _replay(self, record: bytearray):
+        kind, photo_id, timestamp, size, crc = unpack_from(RECORD_FORMAT, record)
+        if kind == RECORD_ADD:
+            self._append(photo_id, timestamp, size, crc)
+            return
+        self._dead += ONE
+        index = self.find(photo_id)
+        if index is None:
+            return
+        if kind == RECORD_UPLOADED:
+            self._flags[index] |= FLAG_UPLOADED
+        elif kind == RECORD_REMOVED:
+            self._mark_removed(index)
+
+    # Writing photos
+    # ##############
+    def open_writer(self, expected_length: int, timestamp: Optional[int] = None) -> PhotoWriter:
+        """
+        Evicts old photos until `expected_length` fits under the quota, then
+        opens a temp file for the new photo
+        """
+        self.make_room(expected_length)
+        self._open_writer = PhotoWriter(
+            self.temp_path,
+            time() if timestamp is None else timestamp,
+            expected_length,
+            buffer=self._write_buffer
+        )
+        return self._open_writer
+
+    def commit(self, writer: PhotoWriter) -> Optional[int]:
+        """
+        Verify the temp file (length & JPEG EOI marker), move it into place & record it.
+        A photo that doesn't verify is thrown away.
+
+        :returns int|None: The new photo's id
+        """
+        self._close_writer(writer)
+        if not verify_photo(writer.path, writer.expected_length):
+            self.abort(writer)
+            return None
+        photo_id = self.next_id
+        rename(writer.path, self.path(photo_id, writer.timestamp))
+        self._write_record(RECORD_ADD, photo_id, writer.timestamp, writer.size, writer.crc)
+        self._append(photo_id, writer.timestamp, writer.size, writer.crc)
+        # Catch up on a compaction a remove() had to put off while the writer was open
+        self._maybe_compact()
+        return photo_id
+
+    def save(self, photo: bytearray, timestamp: Optional[int] = None) -> Optional[int]:
+        """
+        Store a photo that's already in RAM (see `Camera.read_photo_into_buffer`)
+        """
+        writer = self.open_writer(len(photo), timestamp)
+        writer.write(photo)
+        return self.commit(writer)
+
+    def abort(self, writer: PhotoWriter):
+        self._close_writer(writer)
+        try:
+            remove(writer.path)
+        except OSError:
+            pass
+
+    # Lookup
+    # ##############
+    def path(self, photo_id: int, timestamp: Optional[int] = None) -> str:
+        if timestamp is None:
+            timestamp = self._stamps[self.find(photo_id)]
+        return '{}/{:06d}_{}.jpg'.format(self.directory, photo_id, timestamp)
+
+    def find(self, photo_id: int) -> Optional[int]:
+        """
+        Binary search for `photo_id`
+        :returns int|None: Index into the index columns
+        """
+        ids = self._ids
+        low = self._head
+        high = len(ids)
+        while low < high:
+            middle = (low + high) // TWO
+            if ids[middle] < photo_id:
+                low = middle + ONE
+            else:
+                high = middle
+        if low < len(ids) and ids[low] == photo_id:
+            return low
+        return None
+
+    def oldest(self) -> Optional[int]:
+        if not len(self):
+            return None
+        return self._ids[self._head]
+
+    def info(self, photo_id: int) -> Optional[dict]:
+        index = self.find(photo_id)
+        if index is None or self._flags[index] & FLAG_REMOVED:
+            return None
+        return {
+            'id': photo_id,
+            'timestamp': self._stamps[index],
+            'size': self._sizes[index],
+            'crc': self._crcs[index],
+            'uploaded': bool(self._flags[index] & FLAG_UPLOADED),
+        }
+
+    def pending(self) -> Iterator[int]:
+        """
+        Ids of photos that haven't been uploaded yet, oldest first
+        """
+        flags = self._flags
+        for index in range(self._head, len(self._ids)):
+            if not flags[index]:
+                yield self._ids[index]
+
+    def next_pending(self) -> Optional[int]:
+        """
+        Oldest photo that hasn't been uploaded yet
+        """
+        flags = self._flags
+        for index in range(self._head, len(flags)):
+            if not flags[index]:
+                return self._ids[index]
+        return None
+
+    def pending_count(self) -> int:
+        flags = self._flags
+        count = ZERO
+        for index in range(self._head, len(flags)):
+            if not flags[index]:
+                count += ONE
+        return count
+
+    # Updates
+    # ##############
+    def mark_uploaded(self, photo_id: int) -> bool:
+        index = self.find(photo_id)
+        if index is None or self._flags[index]:
+            return False
+        self._flags[index] |= FLAG_UPLOADED
+        self._write_record(RECORD_UPLOADED, photo_id)
+        return True
+
+    def remove(self, photo_id: int) -> bool:
+        index = self.find(photo_id)
+        if index is None or self._flags[index] & FLAG_REMOVED:
+            return False
+        try:
+            remove(self.path(photo_id, self._stamps[index]))
+        except OSError:
+            pass
+        self._mark_removed(index)
+        self._write_record(RECORD_REMOVED, photo_id)
+        self._skip_removed()
+        self._maybe_compact()
+        return True
+
+    def make_room(self, n_bytes: int):
+        """
+        Evict the oldest photos until `n_bytes` more fit under the quota
+        """
+        while len(self) and self.total_bytes + n_bytes > self.quota_bytes:
+            self.remove(self.oldest())
+
+    def close(self):
+        if self._manifest is not None:
+            self._manifest.close()
+            self._manifest = None
+
+    # Internals
+    # ##############
+    def _append(self, photo_id: int, timestamp: int, size: int, crc: int):
+        self._ids.append(photo_id)
+        self._stamps.append(timestamp)
+        self._sizes.append(size)
+        self._crcs.append(crc)
+        self._flags.append(ZERO)
+        self.total_bytes += size
+        if photo_id >= self.next_id:
+            self.next_id = photo_id + ONE
+
+    def _mark_removed(self, index: int):
+        self._flags[index] |= FLAG_REMOVED
+        self.total_bytes -= self._sizes[index]
+        # The ADD record is dead weight now as well
+        self._dead += ONE
+
+    def _skip_removed(self):
+        flags = self._flags
+        while self._head < len(flags) and flags[self._head] & FLAG_REMOVED:
+            self._head += ONE
+
+    def _write_record(self, kind: int, photo_id: int, timestamp: int = ZERO, size: int = ZERO, crc: int = ZERO):
+        # Every record has to survive a power cut, so each one is written & synced straight
+        # away. Buffering them wouldn't save a write, so they skip BufferedWriter
+        if self._manifest is None:
+            self._manifest = open(self.manifest_path, 'ab')
+        record = self._record
+        pack_into(RECORD_FORMAT, record, ZERO, kind, photo_id, timestamp, size, crc)
+        self._manifest.write(record)
+        self._manifest.flush()
+        sync()
+
+    def _close_writer(self, writer: PhotoWriter):
+        writer.close()
+        if self._open_writer is writer:
+            self._open_writer = None
+
+    def _maybe_compact(self):
+        if self._open_writer is not None:
+            # Compaction would write through the buffer holding the open photo's unflushed bytes
+            return
+        live = len(self)
+        if self._dead < _MIN_COMPACT or self._dead < live:
+            return
+        self._compact_index()
+        self._compact_manifest()
+
+    def _compact_index(self):
+        head = self._head
+        self._ids = self._ids[head:]
+        self._stamps = self._stamps[head:]
+        self._sizes = self._sizes[head:]
+        self._crcs = self._crcs[head:]
+        self._flags = self._flags[head:]
+        self._head = ZERO
+
+    def _compact_manifest(self):
+        """
+        Rewrite the manifest with one record per live photo (plus its upload record)
+        """
+        self.close()
+        temp_path = self.manifest_path + '.tmp'
+        # Never runs while a PhotoWriter is open, see `_maybe_compact`
+        with BufferedWriter(temp_path, 'wb', buffer=self._write_buffer) as manifest:
+            for index in range(self._head, len(self._ids)):
+                flags = self._flags[index]
+                if flags & FLAG_REMOVED:
+                    continue
+                photo_id = self._ids[index]
+                manifest.write(pack(
+                    RECORD_FORMAT, RECORD_ADD, photo_id,
+                    self._stamps[index], self._sizes[index], self._crcs[index]
+                ))
+                if flags & FLAG_UPLOADED:
+                    manifest.write(pack(RECORD_FORMAT, RECORD_UPLOADED, photo_id, ZERO, ZERO, ZERO))
+        rename(temp_path, self.manifest_path)
+        self._dead = ZERO
+
+
+def verify_photo(file_name: str, expected_length: int) -> bool:
+    """
+    Check the file length & that it ends in the JPEG EOI marker
+    """
+    if stat(file_name)[6] != expected_length:
+        return False
+    with open(file_name, 'rb') as img:
+        img.seek(-TWO, TWO)
+        return img.read(TWO) == JPEG_EOI
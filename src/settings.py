@@ -32,6 +32,7 @@ GREEN_LED = const(15)
 BLUE_LED = const(13)
 BUTTON_PIN = None
 UART_BAUDRATE = const(9600)
+UART_RX_BUFFER = const(2048)
 PROXY_TRIGGER_PIN = None
 PROXY_ECHO_PIN = None
 
@@ -44,5 +45,153 @@ PROXY_PIN_ADAPTER = ZERO
 PROXY_QWIIC_ADAPTER = ONE
 PROXY_ADAPTER = PROXY_QWIIC_ADAPTER
 
+# Camera
+CAMERA_COMMAND_TIMEOUT_MS = const(500)
+# Fastest first, `Camera.setup` settles on the first one that verifies
+CAMERA_BAUD_RATES = (115200, 57600, 38400, 19200, 9600)
+CAMERA_BAUD_VERIFY_ATTEMPTS = const(3)
+CAMERA_BAUD_FILE = 'camera_baud.txt'
+# Frame buffer reads, chunk sizes must be multiples of 4
+CAMERA_MAX_CHUNK = const(8192)
+CAMERA_MIN_CHUNK = const(512)
+CAMERA_MAX_RETRIES = const(5)
+# Double the chunk size after this many clean chunks in a row
+CAMERA_GROW_AFTER = const(4)
+CAMERA_RETRY_BACKOFF_MS = const(20)
+# Image sizes, as the VC0706 encodes them
+CAMERA_SIZE_640X480 = const(0x00)
+CAMERA_SIZE_320X240 = const(0x11)
+CAMERA_SIZE_160X120 = const(0x22)
+
+# Capture triggers
+TRIGGER_PROXY = ZERO
+TRIGGER_BUTTON = ONE
+TRIGGER_MOTION = TWO
+
+# Trigger -> (image size, JPEG compression ratio 0x00-0xFF, higher = smaller file)
+CAMERA_PROFILES = {
+    TRIGGER_PROXY: (CAMERA_SIZE_160X120, 0x50),
+    TRIGGER_BUTTON: (CAMERA_SIZE_640X480, 0x30),
+    TRIGGER_MOTION: (CAMERA_SIZE_320X240, 0x40),
+}
+CAMERA_DEFAULT_TRIGGER = TRIGGER_PROXY
+
+# Burst capture, triggers in CAMERA_BURST_TRIGGERS take a numbered sequence of frames
+CAMERA_BURST_FRAMES = const(3)
+CAMERA_BURST_INTERVAL_MS = const(250)
+CAMERA_BURST_TRIGGERS = (TRIGGER_PROXY, TRIGGER_MOTION)
+
+# Use the VC0706 motion engine instead of polling the proxy sensor
+CAMERA_MOTION_DETECTION = True
+# How long the motion watcher holds the UART while listening for a motion frame
+CAMERA_MOTION_POLL_MS = const(100)
+
+# Flash
+# Writes are buffered up to whole blocks of this size, see utils.buffered_writer
+FLASH_BLOCK_SIZE = const(4096)
+
+# Photo storage
+PHOTO_DIR = 'photos'
+PHOTO_QUOTA_BYTES = const(1024 * 1024)
+
+# Photo uploads
+UPLOAD_URL = API_URL + '/photo'
+UPLOAD_CHUNK_SIZE = const(1024)
+UPLOAD_TIMEOUT_MS = const(10000)
+# Exponential backoff between failed uploads
+UPLOAD_RETRY_BASE_MS = const(1000)
+UPLOAD_RETRY_MAX_MS = const(5 * 60 * 1000)
+# How often an idle uploader re-checks the store without being woken up
+UPLOAD_IDLE_MS = const(60 * 1000)
+
 # Proxy thresholds, etc
-PROXY_DISTANCE_THRESHOLD_CM = const(400)
+# Threshold + PROXY_HYSTERESIS_CM has to stay under PROXY_MAX_CM, or the filter never re-arms
+PROXY_DISTANCE_THRESHOLD_CM = const(150)
+# Proximity filter, see components.proxy.filter
+# Readings in the median window & EMA weight of each new median
+PROXY_FILTER_WINDOW = const(5)
+PROXY_FILTER_ALPHA = 0.4
+# Something has to come inside PROXY_DISTANCE_THRESHOLD_CM & stay for PROXY_DWELL_MS to trigger,
+# then back off past threshold + PROXY_HYSTERESIS_CM before it can trigger again
+PROXY_HYSTERESIS_CM = const(30)
+PROXY_DWELL_MS = const(300)
+# Readings further than this from the window's median are dropped as outliers
+PROXY_MAX_JUMP_CM = const(100)
+# HC-SR04 range, anything outside it is noise
+PROXY_MIN_CM = const(2)
+PROXY_MAX_CM = const(400)
+# Qwiic calibration table, JSON: {"points": [[raw, mm], ...], "extrapolate": false}
+# Falls back to components.proxy.qwiic.VALUE_MM_MAPPING when the file is missing
+PROXY_CALIBRATION_FILE = 'proxy_calibration.json'
+# Past either end of the table: False clamps to the end value, True extends the end segment
+PROXY_CALIBRATION_EXTRAPOLATE = False
+# The proxy is read in the background this often, see components.proxy.sampler
+# (the HC-SR04 needs ~60ms between pings)
+PROXY_SAMPLE_INTERVAL_MS = const(100)
+
+# Polling governor, see utils.governor
+# Active rates are TICK_RATE_MS for the main loop (button) & PROXY_SAMPLE_INTERVAL_MS for the proxy.
+# They stay active for SLEEP_DURATION_MS after the last activity, then the intervals double
+# every GOVERNOR_DECAY_MS until they reach these idle ones.
+# An idle proxy interval adds at most itself to an approach, keep it near PROXY_DWELL_MS
+GOVERNOR_IDLE_TICK_MS = const(100)
+PROXY_IDLE_INTERVAL_MS = const(300)
+GOVERNOR_DECAY_MS = const(1000)
+GOVERNOR_MAX_LEVEL = const(4)
+# A reading this far from the filtered distance counts as activity
+GOVERNOR_CHANGE_CM = const(20)
+
+# MQTT telemetry
+MQTT_CLIENT_ID = 'cabin-iot-board'
+MQTT_TELEMETRY_TOPIC = 'cabin/telemetry'
+MQTT_KEEPALIVE_SEC = const(60)
+# Connecting & each read/write to the broker, so a dead one can't stall the event loop
+MQTT_TIMEOUT_MS = const(5000)
+# Records per published batch, a batch goes out early once MQTT_FLUSH_INTERVAL_MS has passed
+MQTT_BATCH_RECORDS = const(32)
+MQTT_FLUSH_INTERVAL_MS = const(10 * 1000)
+# Sensor readings are sampled down to one per kind per interval
+MQTT_READING_INTERVAL_MS = const(1000)
+# Offline queue, batches spill from RAM to flash & are dropped once the flash queue is full
+MQTT_QUEUE_RAM_BATCHES = const(8)
+MQTT_QUEUE_FILE = 'telemetry_queue.bin'
+MQTT_QUEUE_FLASH_BYTES = const(64 * 1024)
+MQTT_RETRY_BASE_MS = const(1000)
+MQTT_RETRY_MAX_MS = const(5 * 60 * 1000)
+
+# Wi-Fi
+# How long one connect attempt gets & how often it's polled while it's in progress
+WIFI_CONNECT_TIMEOUT_MS = const(15 * 1000)
+WIFI_POLL_MS = const(250)
+# How often a connected manager checks the link & the power-save mode
+WIFI_CHECK_MS = const(2000)
+WIFI_RETRY_BASE_MS = const(1000)
+WIFI_RETRY_MAX_MS = const(60 * 1000)
+
+# Logging
+LOG_URL = API_URL + '/logs'
+# RAM ring the hot path writes into, the oldest records are dropped when it's full
+LOG_BUFFER_BYTES = const(4096)
+# Ship a batch once this much is waiting, or LOG_SHIP_INTERVAL_MS after the last one
+LOG_SHIP_BYTES = const(1024)
+LOG_SHIP_INTERVAL_MS = const(30 * 1000)
+LOG_TIMEOUT_MS = const(5000)
+# An error ships early at most this often, & only while we're online
+LOG_ERROR_WAKE_MS = const(10 * 1000)
+# JSON API events (`utils.logger.log`) allowed in flight at once, any more are dropped
+LOG_API_MAX_IN_FLIGHT = const(2)
+# Deflate batches before shipping (needs firmware with the `deflate` module)
+LOG_COMPRESS = True
+# Records that can't be shipped go to fixed-size segment files in LOG_DIR, the oldest
+# segment is deleted to stay under LOG_MAX_SEGMENTS
+LOG_DIR = 'logs'
+LOG_SEGMENT_BYTES = const(4096)
+LOG_MAX_SEGMENTS = const(16)
+
+# Component health, see utils.health
+# Failures in a row before a component's circuit opens
+HEALTH_FAILURE_THRESHOLD = const(3)
+HEALTH_RETRY_BASE_MS = const(1000)
+HEALTH_RETRY_MAX_MS = const(5 * 60 * 1000)
+# Distinct errors remembered for deduplication
+HEALTH_MAX_ERROR_KEYS = const(16)
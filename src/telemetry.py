@@ -0,0 +1,395 @@
+"""
+MQTT telemetry
+
+Sensor readings & capture events are packed into fixed-size binary records:
+
+    timestamp (I) | kind (B) | value (i)
+
+& published in batches of up to `MQTT_BATCH_RECORDS` to `MQTT_TELEMETRY_TOPIC`.
+While the broker can't be reached, finished batches wait in a small RAM queue, spill over
+to a length-prefixed file on flash (`MQTT_QUEUE_FILE`) & drain oldest first once it's back.
+Only `run` touches flash, recording a reading never waits on (or fails with) a file write.
+
+The client (amqtt) talks to the broker through uasyncio streams with a timeout on every step,
+so a slow or missing broker never holds up the event loop.
+"""
+from os import remove, stat
+from uasyncio import Event, TimeoutError, wait_for_ms
+from ustruct import calcsize, pack, pack_into, unpack
+from utime import ticks_add, ticks_diff, ticks_ms, time
+from micropython import const
+from typing import Callable, Optional
+
+from constants import ZERO, ONE, TWO, SIXTY, THOUSAND
+from settings import (
+    FLASH_BLOCK_SIZE,
+    MQTT_BATCH_RECORDS, MQTT_BROKER_HOST, MQTT_BROKER_PORT, MQTT_CLIENT_ID, MQTT_FLUSH_INTERVAL_MS, MQTT_KEEPALIVE_SEC, MQTT_QUEUE_FILE,
+    MQTT_QUEUE_FLASH_BYTES, MQTT_QUEUE_RAM_BATCHES, MQTT_READING_INTERVAL_MS, MQTT_RETRY_BASE_MS,
+    MQTT_RETRY_MAX_MS, MQTT_TELEMETRY_TOPIC, MQTT_TIMEOUT_MS
+)
+from utils.buffered_writer import BufferedWriter
+
+
+RECORD_FORMAT = '<IBi'
+RECORD_SIZE = calcsize(RECORD_FORMAT)
+# Each batch on flash is prefixed with its length
+_LENGTH_FORMAT = '<H'
+_LENGTH_SIZE = calcsize(_LENGTH_FORMAT)
+# Batches waiting for `run` to spill them pile up in RAM until this many, then the oldest go
+_RAM_LIMIT = MQTT_QUEUE_RAM_BATCHES * TWO
+
+# Record kinds
+KIND_DISTANCE = const(1)
+KIND_CAPTURE = const(2)
+KIND_MOTION = const(3)
+
+_MINUTE_MS = SIXTY * THOUSAND
+
+
+async def connect_mqtt():
+    """
+    Default client factory, an async connection to the broker over the board's WLAN
+    (None while offline)
+    """
+    # Imported here, so the rest of the module doesn't need `network` (e.g. on the unix port)
+    from board_networks import wifi
+    from amqtt import MQTTClient
+    if not wifi.is_connected():
+        return None
+    client = MQTTClient(
+        MQTT_CLIENT_ID,
+        MQTT_BROKER_HOST,
+        int(MQTT_BROKER_PORT),
+        keepalive=MQTT_KEEPALIVE_SEC,
+        connect_timeout_ms=MQTT_TIMEOUT_MS,
+        timeout_ms=MQTT_TIMEOUT_MS
+    )
+    await client.connect()
+    return client
+
+
+class Telemetry:
+    """
+    >>> telemetry = Telemetry()
+    >>> app.start_task(telemetry.run())
+    >>> telemetry.reading(KIND_DISTANCE, distance)  # Sampled down to one per MQTT_READING_INTERVAL_MS
+    >>> telemetry.record(KIND_CAPTURE, trigger)
+    >>> telemetry.stats  # {'records', 'published', 'messages_per_min', 'records_per_min', 'queue_depth', ...}
+
+    The client factory is async & returns a connected client (anything with awaitable
+    `publish(topic, payload)`, `ping()` & `disconnect()`) or None while offline, so a local
+    broker stand-in can be swapped in (see scripts/mqtt_test_broker.py):
+    >>> async def local_broker():
+    >>>     client = MQTTClient('test', '127.0.0.1', 1883)
+    >>>     await client.connect()
+    >>>     return client
+    >>> telemetry = Telemetry(client_factory=local_broker)
+    """
+    def __init__(self, client_factory: Callable = connect_mqtt, topic: str = MQTT_TELEMETRY_TOPIC,
+                 queue_path: str = MQTT_QUEUE_FILE):
+        self.client_factory = client_factory
+        self.client = None
+        self.topic = topic
+        self.queue_path = queue_path
+        self._batch = bytearray(MQTT_BATCH_RECORDS * RECORD_SIZE)
+        self._count = ZERO
+        self._batch_started = ticks_ms()
+        # Finished batches waiting to go out, oldest first. Anything older is on flash
+        self._queue = []
+        self._flash_bytes = ZERO
+        self._flash_batches = ZERO
+        # Where draining the flash queue got up to
+        self._flash_offset = ZERO
+        # Batches can't be spilled onto the file while it's being drained
+        self._draining_flash = False
+        # A spill that failed part way may have left half a batch at the end of the file,
+        # nothing more goes on until it's been drained & removed
+        self._spill_failed = False
+        # Allocated by the first spill, most boards never need it
+        self._file_buffer = None
+        self._last_reading = {}
+        self._last_sent = ticks_ms()
+        self._rate_started = ticks_ms()
+        self._rate_messages = ZERO
+        self._rate_records = ZERO
+        self.wake = Event()
+        self.backoff_ms = MQTT_RETRY_BASE_MS
+        self.stats = {
+            'records': ZERO,
+            'published': ZERO,
+            'bytes': ZERO,
+            'messages_per_min': ZERO,
+            'records_per_min': ZERO,
+            'queue_depth': ZERO,
+            'queued_on_flash': ZERO,
+            'dropped': ZERO,
+            'connects': ZERO,
+            'failures': ZERO,
+        }
+        self._load_flash_queue()
+
+    # Recording
+    # ##############
+    def record(self, kind: int, value: int, timestamp: Optional[int] = None):
+        pack_into(
+            RECORD_FORMAT, self._batch, self._count * RECORD_SIZE,
+            time() if timestamp is None else timestamp, kind, value
+        )
+        self._count += ONE
+        self.stats['records'] += ONE
+        if self._count == MQTT_BATCH_RECORDS:
+            self._finish_batch()
+
+    def reading(self, kind: int, value: int) -> bool:
+        """
+        Record a sensor reading, unless one of the same kind was recorded
+        less than `MQTT_READING_INTERVAL_MS` ago
+
+        :returns bool: Whether it was recorded
+        """
+        now = ticks_ms()
+        last = self._last_reading.get(kind)
+        if last is not None and ticks_diff(now, last) < MQTT_READING_INTERVAL_MS:
+            return False
+        self._last_reading[kind] = now
+        self.record(kind, value)
+        return True
+
+    def flush(self):
+        """
+        Publish whatever is in the current batch without waiting for it to fill up
+        """
+        self._finish_batch()
+
+    def _finish_batch(self):
+        if not self._count:
+            return
+        queue = self._queue
+        queue.append(bytes(self._batch[:self._count * RECORD_SIZE]))
+        self._count = ZERO
+        self._batch_started = ticks_ms()
+        # Spilling is up to `run`, this only keeps RAM bounded until it gets to it.
+        # A batch being published was taken off the queue first, so it's never this one
+        while len(queue) > _RAM_LIMIT:
+            queue.pop(ZERO)
+            self.stats['dropped'] += ONE
+        self._update_depth()
+        self.wake.set()
+
+    # Publishing
+    # ##############
+    async def run(self):
+        while True:
+            if not self._queue and not self._flash_batches:
+                await self._wait()
+            if self._count and ticks_diff(ticks_ms(), self._batch_started) >= MQTT_FLUSH_INTERVAL_MS:
+                self._finish_batch()
+            self._spill_overflow()
+            self._update_rates()
+            if not self._queue and not self._flash_batches:
+                await self._keep_alive()
+                continue
+            if await self._connect() and await self._drain():
+                self.backoff_ms = MQTT_RETRY_BASE_MS
+                continue
+            self.stats['failures'] += ONE
+            await self._disconnect()
+            await self._back_off()
+            self.backoff_ms = min(self.backoff_ms * TWO, MQTT_RETRY_MAX_MS)
+
+    async def _wait(self, timeout_ms: int = MQTT_FLUSH_INTERVAL_MS):
+        # Cleared after waking, so a batch finished while we were busy isn't missed
+        try:
+            await wait_for_ms(self.wake.wait(), timeout_ms)
+        except TimeoutError:
+            pass
+        self.wake.clear()
+
+    async def _back_off(self):
+        # Batches keep finishing while we wait to retry, keep spilling them
+        deadline = ticks_add(ticks_ms(), self.backoff_ms)
+        while True:
+            remaining_ms = ticks_diff(deadline, ticks_ms())
+            if remaining_ms <= ZERO:
+                return
+            await self._wait(remaining_ms)
+            self._spill_overflow()
+
+    async def _connect(self) -> bool:
+        if self.client is not None:
+            return True
+        try:
+            self.client = await self.client_factory()
+        except (OSError, ImportError, TimeoutError) as err:
+            print('MQTT connect failed', err)
+            self.client = None
+        if self.client is None:
+            return False
+        self.stats['connects'] += ONE
+        self._last_sent = ticks_ms()
+        return True
+
+    async def _disconnect(self):
+        if self.client is not None:
+            try:
+                await self.client.disconnect()
+            except (OSError, TimeoutError):
+                pass
+            self.client = None
+
+    async def _keep_alive(self):
+        # We only talk to the broker when we publish, ping before the broker gives up on us
+        if self.client is None:
+            return
+        if ticks_diff(ticks_ms(), self._last_sent) < MQTT_KEEPALIVE_SEC * THOUSAND // TWO:
+            return
+        try:
+            await self.client.ping()
+            self._last_sent = ticks_ms()
+        except (OSError, TimeoutError):
+            await self._disconnect()
+
+    async def _drain(self) -> bool:
+        """
+        Publish the flash queue, then the RAM queue, oldest first
+        :returns bool: False if the connection failed part way through
+        """
+        try:
+            if self._flash_batches:
+                await self._drain_flash()
+            queue = self._queue
+            while queue:
+                # Off the queue while it's in flight, so nothing else can drop it meanwhile
+                payload = queue.pop(ZERO)
+                try:
+                    await self._publish(payload)
+                except BaseException:
+                    queue.insert(ZERO, payload)
+                    raise
+                self._update_depth()
+        except (OSError, TimeoutError) as err:
+            print('MQTT publish failed', err)
+            return False
+        return True
+
+    async def _publish(self, payload: bytes):
+        await self.client.publish(self.topic, payload)
+        self._last_sent = ticks_ms()
+        stats = self.stats
+        stats['published'] += ONE
+        stats['bytes'] += len(payload)
+        self._rate_messages += ONE
+        self._rate_records += len(payload) // RECORD_SIZE
+
+    def _update_rates(self):
+        elapsed = ticks_diff(ticks_ms(), self._rate_started)
+        if elapsed < _MINUTE_MS:
+            return
+        self.stats['messages_per_min'] = self._rate_messages * _MINUTE_MS // elapsed
+        self.stats['records_per_min'] = self._rate_records * _MINUTE_MS // elapsed
+        self._rate_messages = ZERO
+        self._rate_records = ZERO
+        self._rate_started = ticks_ms()
+
+    def _update_depth(self):
+        self.stats['queue_depth'] = len(self._queue) + self._flash_batches
+        self.stats['queued_on_flash'] = self._flash_batches
+
+    # Flash queue
+    # ##############
+    def _load_flash_queue(self):
+        """
+        Count the batches left on flash by a previous run
+        """
+        try:
+            self._flash_bytes = stat(self.queue_path)[6]
+        except OSError:
+            return
+        with open(self.queue_path, 'rb') as queue:
+            while True:
+                header = queue.read(_LENGTH_SIZE)
+                if len(header) < _LENGTH_SIZE:
+                    break
+                queue.seek(unpack(_LENGTH_FORMAT, header)[ZERO], ONE)
+                self._flash_batches += ONE
+        self._update_depth()
+
+    def _spill_overflow(self):
+        """
+        Move the batches over `MQTT_QUEUE_RAM_BATCHES` onto flash, oldest first, in one write session.
+        Whatever doesn't fit (or can't be written) is dropped
+        """
+        queue = self._queue
+        if len(queue) <= MQTT_QUEUE_RAM_BATCHES or self._draining_flash:
+            return
+        stats = self.stats
+        if self._spill_failed:
+            self._drop_overflow()
+            return
+        if self._file_buffer is None:
+            self._file_buffer = bytearray(FLASH_BLOCK_SIZE)
+        flash_bytes = self._flash_bytes
+        flash_batches = self._flash_batches
+        try:
+            with BufferedWriter(self.queue_path, 'ab', buffer=self._file_buffer) as spill:
+                while len(queue) > MQTT_QUEUE_RAM_BATCHES:
+                    payload = queue.pop(ZERO)
+                    size = _LENGTH_SIZE + len(payload)
+                    if flash_bytes + size > MQTT_QUEUE_FLASH_BYTES:
+                        stats['dropped'] += ONE
+                        continue
+                    spill.write(pack(_LENGTH_FORMAT, len(payload)))
+                    spill.write(payload)
+                    flash_bytes += size
+                    flash_batches += ONE
+        except OSError as err:
+            # e.g. the filesystem is full, none of this session's batches can be trusted
+            print('MQTT queue spill failed', err)
+            stats['dropped'] += flash_batches - self._flash_batches
+            if self._flash_batches:
+                self._spill_failed = True
+            else:
+                # Nothing older to keep, start from a fresh file next time
+                self._remove_flash_queue()
+            self._drop_overflow()
+            return
+        self._flash_bytes = flash_bytes
+        self._flash_batches = flash_batches
+        self._update_depth()
+
+    def _drop_overflow(self):
+        queue = self._queue
+        while len(queue) > MQTT_QUEUE_RAM_BATCHES:
+            queue.pop(ZERO)
+            self.stats['dropped'] += ONE
+        self._update_depth()
+
+    async def _drain_flash(self):
+        # The offset only lives in RAM, a reboot mid-drain re-sends what was already published
+        self._draining_flash = True
+        try:
+            with open(self.queue_path, 'rb') as queue:
+                queue.seek(self._flash_offset)
+                while self._flash_batches:
+                    header = queue.read(_LENGTH_SIZE)
+                    if len(header) < _LENGTH_SIZE:
+                        break
+                    payload = queue.read(unpack(_LENGTH_FORMAT, header)[ZERO])
+                    await self._publish(payload)
+                    self._flash_offset += _LENGTH_SIZE + len(payload)
+                    self._flash_batches -= ONE
+                    self._update_depth()
+        finally:
+            self._draining_flash = False
+        self._remove_flash_queue()
+
+    def _remove_flash_queue(self):
+        try:
+            remove(self.queue_path)
+        except OSError:
+            pass
+        self._flash_bytes = ZERO
+        self._flash_batches = ZERO
+        self._flash_offset = ZERO
+        self._spill_failed = False
+        self._update_depth()
@@ -0,0 +1,118 @@
+"""
+Background photo uploads
+
+Drains the photo store to `UPLOAD_URL`, oldest first. Each photo is streamed off flash
+in `UPLOAD_CHUNK_SIZE` pieces from one reused buffer, so the JPEG is never loaded into RAM.
+Posts go through `arequests` on uasyncio streams, capture never waits on the network.
+"""
+from uasyncio import Event, TimeoutError, sleep_ms, wait_for_ms
+from utime import ticks_diff, ticks_ms
+
+import arequests
+
+from constants import ZERO, ONE, TWO, THOUSAND
+from photo_store import PhotoStore
+from settings import (
+    UPLOAD_CHUNK_SIZE, UPLOAD_IDLE_MS, UPLOAD_RETRY_BASE_MS, UPLOAD_RETRY_MAX_MS, UPLOAD_TIMEOUT_MS,
+    UPLOAD_URL
+)
+
+
+class Uploader:
+    """
+    >>> uploader = Uploader(store, wifi=wifi)
+    >>> app.start_task(uploader.run())
+    >>> # ... after each capture
+    >>> uploader.notify()
+    >>> uploader.stats  # {'uploaded', 'failures', 'bytes', 'bytes_per_sec', 'queue_depth'}
+    """
+    def __init__(self, store: PhotoStore, url: str = UPLOAD_URL, wifi=None):
+        """
+        :param wifi: Optional `WifiManager`, uploads wait for it to connect instead of failing & backing off
+        """
+        self.store = store
+        self.wifi = wifi
+        self.url = url
+        self.buffer = bytearray(UPLOAD_CHUNK_SIZE)
+        self.wake = Event()
+        self.backoff_ms = UPLOAD_RETRY_BASE_MS
+        self.stats = {
+            'uploaded': ZERO,
+            'failures': ZERO,
+            'bytes': ZERO,
+            'bytes_per_sec': ZERO,
+            'queue_depth': ZERO,
+        }
+
+    def is_busy(self) -> bool:
+        return self.store.next_pending() is not None
+
+    def notify(self):
+        """
+        Let the worker know there's a new photo waiting
+        """
+        self.wake.set()
+
+    async def run(self):
+        store = self.store
+        stats = self.stats
+        while True:
+            stats['queue_depth'] = store.pending_count()
+            photo_id = store.next_pending()
+            if photo_id is None:
+                await self._idle()
+                continue
+            if self.wifi is not None and not self.wifi.is_connected():
+                await self.wifi.connected.wait()
+            if await self.upload(photo_id):
+                store.mark_uploaded(photo_id)
+                self.backoff_ms = UPLOAD_RETRY_BASE_MS
+                continue
+            stats['failures'] += ONE
+            await sleep_ms(self.backoff_ms)
+            self.backoff_ms = min(self.backoff_ms * TWO, UPLOAD_RETRY_MAX_MS)
+
+    async def _idle(self):
+        self.wake.clear()
+        try:
+            await wait_for_ms(self.wake.wait(), UPLOAD_IDLE_MS)
+        except TimeoutError:
+            pass
+
+    async def upload(self, photo_id: int) -> bool:
+        info = self.store.info(photo_id)
+        if info is None:
+            # Evicted before we got to it
+            return True
+        started = ticks_ms()
+        try:
+            is_uploaded = await wait_for_ms(self._post(info), UPLOAD_TIMEOUT_MS)
+        except Exception as err:
+            # Whatever the server or the network did, back off & retry rather than lose the worker
+            print('Photo upload failed', photo_id, err)
+            return False
+        if is_uploaded:
+            elapsed = ticks_diff(ticks_ms(), started)
+            stats = self.stats
+            stats['uploaded'] += ONE
+            stats['bytes'] += info['size']
+            stats['bytes_per_sec'] = (info['size'] * THOUSAND) // max(elapsed, ONE)
+        return is_uploaded
+
+    async def _post(self, info: dict) -> bool:
+        with open(self.store.path(info['id']), 'rb') as photo:
+            resp = await arequests.post(
+                self.url,
+                data=photo,
+                headers={
+                    'Content-Type': 'image/jpeg',
+                    'Content-Length': str(info['size']),
+                    'X-Photo-Id': str(info['id']),
+                    'X-Photo-Timestamp': str(info['timestamp']),
+                    'X-Photo-Crc': str(info['crc']),
+                },
+                read_timeout_ms=UPLOAD_TIMEOUT_MS,
+                buffer=self.buffer
+            )
+        resp.close()
+        return 200 <= resp.status_code < 300
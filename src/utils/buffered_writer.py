@@ -0,0 +1,151 @@
+"""
+Block-aligned buffered file writes
+
+LittleFS/FAT on the ESP32 rewrite a whole flash block for every partial-block write,
+so lots of small appends cost far more than the bytes suggest. `BufferedWriter` collects
+writes in a reusable buffer & only hands the filesystem whole, block-aligned blocks
+(until an explicit `flush`/`close`).
+"""
+from os import stat
+from utime import ticks_diff, ticks_ms
+from micropython import const
+
+from constants import ZERO, ONE
+from settings import FLASH_BLOCK_SIZE
+
+try:
+    from os import sync as _fs_sync
+except ImportError:
+    _fs_sync = None
+
+
+# Sync policies, when to ask the filesystem to commit to flash
+SYNC_NEVER = const(0)
+SYNC_ON_CLOSE = const(1)
+SYNC_ON_FLUSH = const(2)
+
+# Totals across every writer, see `stats()`
+_totals = {
+    'bytes': ZERO,
+    'writes': ZERO,
+    'write_ms': ZERO,
+    'max_write_ms': ZERO,
+}
+
+
+def stats() -> dict:
+    """
+    :returns dict: Bytes written, number of filesystem writes & write latency across all writers
+    """
+    return _totals
+
+
+class BufferedWriter:
+    """
+    >>> with BufferedWriter('logs.txt') as logs:
+    >>>     logs.write('hello\n')
+    >>>     logs.write(b'world\n')
+    """
+    def __init__(self, path: str, mode: str = 'ab', block_size: int = FLASH_BLOCK_SIZE,
+                 sync_policy: int = SYNC_ON_CLOSE, buffer: bytearray = None):
+        """
+        :param buffer: Optional preallocated buffer (at least `block_size` bytes) to reuse between writers
+        """
+        self.path = path
+        self.block_size = block_size
+        self.sync_policy = sync_policy
+        self.buffer = buffer if buffer is not None else bytearray(block_size)
+        self._view = memoryview(self.buffer)
+        self._fill = ZERO
+        self.bytes_written = ZERO
+        self.writes = ZERO
+        self.write_ms = ZERO
+        self.max_write_ms = ZERO
+        # Appending picks up wherever the file ends, which may be mid-block
+        self._offset = ZERO
+        if 'a' in mode:
+            try:
+                self._offset = stat(path)[6]
+            except OSError:
+                pass
+        self.file = open(path, mode)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def _room(self) -> int:
+        """
+        Bytes until the buffer lines up with the next block boundary in the file
+        """
+        return self.block_size - ((self._offset + self._fill) % self.block_size)
+
+    def write(self, data) -> int:
+        if isinstance(data, str):
+            data = data.encode()
+        data = memoryview(data)
+        n_bytes = len(data)
+        start = ZERO
+        while start < n_bytes:
+            room = self._room()
+            remaining = n_bytes - start
+            if self._fill == ZERO and remaining >= room:
+                # Already aligned, skip the copy & write whole blocks straight through
+                aligned = room + ((remaining - room) // self.block_size) * self.block_size
+                self._write(data[start:start + aligned])
+                start += aligned
+                continue
+            count = min(room, remaining)
+            self._view[self._fill:self._fill + count] = data[start:start + count]
+            self._fill += count
+            start += count
+            if self._room() == self.block_size:
+                self._write_buffer()
+        return n_bytes
+
+    def flush(self):
+        """
+        Write out whatever is buffered, even if it's a partial block
+        """
+        if self._fill:
+            self._write_buffer()
+        self.file.flush()
+        if self.sync_policy == SYNC_ON_FLUSH:
+            sync()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.flush()
+        self.file.close()
+        self.file = None
+        if self.sync_policy == SYNC_ON_CLOSE:
+            sync()
+
+    def _write_buffer(self):
+        self._write(self._view[:self._fill])
+        self._fill = ZERO
+
+    def _write(self, data):
+        started = ticks_ms()
+        self.file.write(data)
+        elapsed = ticks_diff(ticks_ms(), started)
+        n_bytes = len(data)
+        self._offset += n_bytes
+        self.bytes_written += n_bytes
+        self.writes += ONE
+        self.write_ms += elapsed
+        if elapsed > self.max_write_ms:
+            self.max_write_ms = elapsed
+        _totals['bytes'] += n_bytes
+        _totals['writes'] += ONE
+        _totals['write_ms'] += elapsed
+        if elapsed > _totals['max_write_ms']:
+            _totals['max_write_ms'] = elapsed
+
+
+def sync():
+    if _fs_sync is not None:
+        _fs_sync()
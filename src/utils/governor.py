@@ -0,0 +1,97 @@
+"""
+Polling governor, how fast the board polls its sensors
+
+The cabin is empty most of the time, so polling slows down to an idle rate when nothing
+is happening. Activity (proximity changing, the button, a capture) ramps straight back up
+to the active rate. Once it's been quiet for `hold_ms` the rate decays, doubling the
+interval every `decay_ms`, until it reaches idle again.
+
+Each rate is an (active_ms, idle_ms) pair, so one governor drives the proxy sampler &
+the main loop's tick together.
+"""
+from utime import ticks_diff, ticks_ms
+from micropython import const
+
+from constants import ZERO, ONE
+
+ACTIVE = const(0)
+DECAYING = const(1)
+IDLE = const(2)
+
+_MODE_STATS = ('active_ms', 'decaying_ms', 'idle_ms')
+
+
+class Governor:
+    """
+    >>> governor = Governor(hold_ms=SLEEP_DURATION_MS)
+    >>> governor.activity()  # Something happened, poll fast
+    >>> governor.update()
+    >>> tick_ms = governor.rate(TICK_RATE_MS, GOVERNOR_IDLE_TICK_MS)
+    >>> governor.stats  # {'mode', 'level', 'ramps', 'active_ms', 'decaying_ms', 'idle_ms'}
+    """
+    def __init__(self, hold_ms: int, decay_ms: int = 1000, max_level: int = 4):
+        """
+        :param hold_ms: Stay at the active rate this long after the last activity
+        :param decay_ms: Then double the intervals this often
+        :param max_level: Doublings until idle, rates are capped at their idle_ms before that
+        """
+        self.hold_ms = hold_ms
+        self.decay_ms = decay_ms
+        self.max_level = max_level
+        # Start idle, the first activity ramps up
+        self.level = max_level
+        self.mode = IDLE
+        self._activity_at = ticks_ms()
+        self._updated_at = ticks_ms()
+        self.stats = {
+            'mode': IDLE,
+            'level': max_level,
+            'ramps': ZERO,
+            'active_ms': ZERO,
+            'decaying_ms': ZERO,
+            'idle_ms': ZERO,
+        }
+
+    def activity(self):
+        """
+        Back to the active rate, straight away
+        """
+        self.update()
+        if self.mode != ACTIVE:
+            self.stats['ramps'] += ONE
+        self._activity_at = self._updated_at
+        self._set_level(ZERO)
+
+    def update(self):
+        """
+        Count the time since the last update against the current mode, then decay
+        """
+        now = ticks_ms()
+        stats = self.stats
+        stats[_MODE_STATS[self.mode]] += ticks_diff(now, self._updated_at)
+        self._updated_at = now
+        quiet_ms = ticks_diff(now, self._activity_at)
+        if quiet_ms < self.hold_ms:
+            level = ZERO
+        else:
+            level = min(ONE + (quiet_ms - self.hold_ms) // self.decay_ms, self.max_level)
+        # Decay only ever slows things down, activity() is what speeds them up
+        if level > self.level:
+            self._set_level(level)
+
+    def rate(self, active_ms: int, idle_ms: int) -> int:
+        """
+        :returns int: Interval for the current level, active_ms doubled per level, at most idle_ms
+        """
+        return min(active_ms << self.level, idle_ms)
+
+    def _set_level(self, level: int):
+        self.level = level
+        if level == ZERO:
+            self.mode = ACTIVE
+        elif level >= self.max_level:
+            self.mode = IDLE
+        else:
+            self.mode = DECAYING
+        self.stats['level'] = level
+        self.stats['mode'] = self.mode
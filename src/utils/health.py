@@ -0,0 +1,190 @@
+"""
+Component health registry
+
+Every component call from the main loop goes through `Health.call`/`call_async`, which
+gives each component its own circuit breaker. After `HEALTH_FAILURE_THRESHOLD` failures
+in a row the breaker opens & the component is skipped (its default is returned instead)
+until the backoff runs out. Then one trial call is let through: success closes the
+breaker, failure reopens it with double the backoff. A dead sensor is isolated while
+everything else keeps running at full rate.
+
+Components that report failure with a return value rather than an exception (e.g. a
+camera setup returning False) pass a `failed` predicate, see `is_false`/`is_none`.
+
+Repeats of the same error are counted rather than logged again.
+"""
+from utime import ticks_add, ticks_diff, ticks_ms
+from micropython import const
+
+from constants import ZERO, ONE, TWO
+from settings import HEALTH_FAILURE_THRESHOLD, HEALTH_MAX_ERROR_KEYS, HEALTH_RETRY_BASE_MS, HEALTH_RETRY_MAX_MS
+from utils.log_records import CODE_HEALTH, LEVEL_INFO, LEVEL_WARNING
+
+CLOSED = const(0)
+OPEN = const(1)
+HALF_OPEN = const(2)
+
+
+def is_false(result) -> bool:
+    return result is False
+
+
+def is_none(result) -> bool:
+    return result is None
+
+
+class CircuitBreaker:
+    def __init__(self, name: str, threshold: int = HEALTH_FAILURE_THRESHOLD,
+                 base_ms: int = HEALTH_RETRY_BASE_MS, max_ms: int = HEALTH_RETRY_MAX_MS):
+        self.name = name
+        self.threshold = threshold
+        self.base_ms = base_ms
+        self.max_ms = max_ms
+        self.state = CLOSED
+        self.failures = ZERO
+        self.backoff_ms = base_ms
+        self.retry_at = ZERO
+        self.opened = ZERO
+        self.errors = ZERO
+        self.suppressed = ZERO
+
+    def allow(self) -> bool:
+        if self.state == CLOSED:
+            return True
+        if self.state == OPEN and self.retry_in_ms() == ZERO:
+            self.state = HALF_OPEN
+            return True
+        # Half open, calls go through until one of them succeeds or fails
+        return self.state == HALF_OPEN
+
+    def retry_in_ms(self) -> int:
+        if self.state != OPEN:
+            return ZERO
+        return max(ticks_diff(self.retry_at, ticks_ms()), ZERO)
+
+    def success(self) -> bool:
+        """
+        :returns bool: True if this closed the breaker
+        """
+        was_open = self.state != CLOSED
+        self.state = CLOSED
+        self.failures = ZERO
+        self.backoff_ms = self.base_ms
+        return was_open
+
+    def failure(self) -> bool:
+        """
+        :returns bool: True if this opened the breaker
+        """
+        self.failures += ONE
+        self.errors += ONE
+        if self.state == HALF_OPEN or self.failures >= self.threshold:
+            if self.state == HALF_OPEN:
+                self.backoff_ms = min(self.backoff_ms * TWO, self.max_ms)
+            self.state = OPEN
+            self.retry_at = ticks_add(ticks_ms(), self.backoff_ms)
+            self.opened += ONE
+            return True
+        return False
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'state': self.state,
+            'failures': self.failures,
+            'errors': self.errors,
+            'suppressed': self.suppressed,
+            'opened': self.opened,
+            'backoff_ms': self.backoff_ms,
+        }
+
+
+class Health:
+    """
+    >>> health = Health(logger)
+    >>> pressed = health.call('button', button.is_pressed, default=False)
+    >>> distance = await health.call_async('proxy', proxy.async_get_distance, default=False)
+    >>> await health.call_async('camera', camera.setup, default=False, failed=is_false)
+    >>> health.stats  # {'button': {'state', 'failures', 'errors', 'suppressed', 'opened', 'backoff_ms'}, ...}
+    """
+    def __init__(self, logger=None):
+        self.logger = logger
+        self.breakers = {}
+        # '<component>: <error>' -> times seen
+        self._seen = {}
+
+    def breaker(self, name: str) -> CircuitBreaker:
+        breaker = self.breakers.get(name)
+        if breaker is None:
+            breaker = self.breakers[name] = CircuitBreaker(name)
+        return breaker
+
+    def is_available(self, name: str) -> bool:
+        return self.breaker(name).allow()
+
+    def call(self, name: str, fn, *args, default=None, failed=None):
+        """
+        :param failed: Optional predicate, True for a result that means `fn` failed
+        """
+        breaker = self.breaker(name)
+        if not breaker.allow():
+            return default
+        try:
+            result = fn(*args)
+        except Exception as err:
+            self.failure(name, err)
+            return default
+        self._check(name, fn, result, failed)
+        return result
+
+    async def call_async(self, name: str, fn, *args, default=None, failed=None):
+        breaker = self.breaker(name)
+        if not breaker.allow():
+            return default
+        try:
+            result = await fn(*args)
+        except Exception as err:
+            self.failure(name, err)
+            return default
+        self._check(name, fn, result, failed)
+        return result
+
+    def _check(self, name: str, fn, result, failed):
+        if failed is not None and failed(result):
+            self.failure(name, RuntimeError('{} returned {}'.format(getattr(fn, '__name__', fn), result)))
+        else:
+            self.success(name)
+
+    def success(self, name: str):
+        breaker = self.breaker(name)
+        if breaker.success():
+            self._log('{} recovered, {} repeated errors suppressed'.format(name, breaker.suppressed), LEVEL_INFO)
+            breaker.suppressed = ZERO
+
+    def failure(self, name: str, err: Exception):
+        breaker = self.breaker(name)
+        key = '{}: {}'.format(name, repr(err))
+        seen = self._seen.get(key, ZERO)
+        if not seen:
+            if len(self._seen) >= HEALTH_MAX_ERROR_KEYS:
+                self._seen.clear()
+            if self.logger is not None:
+                self.logger.error(key)
+        else:
+            breaker.suppressed += ONE
+        self._seen[key] = seen + ONE
+        if breaker.failure():
+            self._log('{} circuit open for {} ms after {} failures'.format(
+                name, breaker.backoff_ms, breaker.failures
+            ), LEVEL_WARNING)
+
+    def retry_in_ms(self, name: str) -> int:
+        return self.breaker(name).retry_in_ms()
+
+    @property
+    def stats(self) -> dict:
+        return {name: breaker.stats for name, breaker in self.breakers.items()}
+
+    def _log(self, message: str, level: int):
+        if self.logger is not None:
+            self.logger.log(message, level, CODE_HEALTH)
@@ -0,0 +1,119 @@
+"""
+Binary log records
+
+    timestamp (I) | level (B) | code (H) | payload length (B) | payload
+
+The header is 8 bytes & payloads are capped at 255, so a typical event costs a
+dozen or so bytes instead of a formatted line of text.
+Decode them on the host with scripts/decode_logs.py.
+"""
+from ustruct import calcsize, pack, pack_into
+from micropython import const
+
+from constants import ZERO, HUNDRED
+
+RECORD_FORMAT = '<IBHB'
+HEADER_SIZE = calcsize(RECORD_FORMAT)
+# Where the payload length sits in the header
+LENGTH_OFFSET = const(7)
+MAX_PAYLOAD = const(255)
+MAX_RECORD = HEADER_SIZE + MAX_PAYLOAD
+
+# Levels
+LEVEL_DEBUG = const(0)
+LEVEL_INFO = const(1)
+LEVEL_WARNING = const(2)
+LEVEL_ERROR = const(3)
+
+# Codes, what the payload holds
+CODE_MESSAGE = const(0)     # Free text
+CODE_ERROR = const(1)       # Exception text
+CODE_PHOTO = const(2)       # <IIII photo id, ms, baud rate, peak heap bytes
+CODE_TRANSFER = const(3)    # TRANSFER_FORMAT, then <H per chunk size change, see `pack_transfer`
+CODE_BURST = const(4)       # BURST_FORMAT, see `pack_burst`
+CODE_FLASH = const(5)       # <IIII bytes, writes, write ms, max write ms
+CODE_CAMERA = const(6)      # <I baud rate, then BAUD_FORMAT per rate tried, see `pack_baud_report`
+CODE_HEALTH = const(7)      # Text, circuit breakers opening & recovering
+
+# buffer length, bytes, elapsed ms, bytes/sec, retries, complete
+TRANSFER_FORMAT = '<IIIIHB'
+# frames, elapsed ms, frames/sec * 100
+BURST_FORMAT = '<HII'
+# baud rate, verify ms, capture ms, bytes/sec
+BAUD_FORMAT = '<IIII'
+
+
+def pack_record(buf, timestamp: int, level: int, code: int, payload=b'') -> int:
+    """
+    Write one record to the start of `buf` (at least `MAX_RECORD` bytes), longer payloads are cut off
+    :returns int: Record length
+    """
+    length = min(len(payload), MAX_PAYLOAD)
+    pack_into(RECORD_FORMAT, buf, ZERO, timestamp, level, code, length)
+    memoryview(buf)[HEADER_SIZE:HEADER_SIZE + length] = memoryview(payload)[:length]
+    return HEADER_SIZE + length
+
+
+def pack_transfer(stats: dict) -> bytes:
+    """
+    `TransferController.stats` as a CODE_TRANSFER payload, the chunk history as many as fit
+    """
+    payload = pack(
+        TRANSFER_FORMAT,
+        stats.get('buffer_length', ZERO),
+        stats.get('bytes', ZERO),
+        stats.get('elapsed_ms', ZERO),
+        stats.get('bytes_per_sec', ZERO),
+        stats.get('retries', ZERO),
+        int(stats.get('complete', False))
+    )
+    history = stats.get('chunk_history', ())
+    if not history:
+        return payload
+    count = min(len(history), (MAX_PAYLOAD - len(payload)) // 2)
+    return payload + pack('<%dH' % count, *history[:count])
+
+
+def pack_burst(stats: dict) -> bytes:
+    return pack(
+        BURST_FORMAT,
+        stats.get('frames', ZERO),
+        stats.get('elapsed_ms', ZERO),
+        int(stats.get('fps', ZERO) * HUNDRED)
+    )
+
+
+def pack_baud_report(baudrate: int, report: dict) -> bytes:
+    """
+    `Camera.baud_report` as a CODE_CAMERA payload, led by the rate the camera ended up at
+    """
+    payload = pack('<I', baudrate)
+    for rate, results in report.items():
+        if len(payload) + calcsize(BAUD_FORMAT) > MAX_PAYLOAD:
+            break
+        payload += pack(
+            BAUD_FORMAT,
+            rate,
+            results.get('verify_ms', ZERO),
+            results.get('capture_ms', ZERO),
+            results.get('bytes_per_sec', ZERO)
+        )
+    return payload
+
+
+def record_length(buf, offset: int = ZERO) -> int:
+    return HEADER_SIZE + buf[offset + LENGTH_OFFSET]
+
+
+def whole_records(buf, count: int) -> int:
+    """
+    :returns int: Bytes at the start of `buf[:count]` taken up by whole records
+    """
+    end = ZERO
+    while end + HEADER_SIZE <= count:
+        length = record_length(buf, end)
+        if end + length > count:
+            break
+        end += length
+    return end
+
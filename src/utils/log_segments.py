@@ -0,0 +1,96 @@
+"""
+Size-capped log storage on flash
+
+Records are appended to numbered, fixed-size segment files (`logs/000001.bin`, ...).
+A segment is closed once the next record wouldn't fit, records never straddle two.
+Once there are more than `max_segments`, the oldest one is deleted, so the logs
+never take more than `segment_bytes * max_segments` of flash.
+"""
+from os import listdir, mkdir, remove, stat
+from typing import Optional
+
+from constants import ZERO, ONE
+from settings import LOG_DIR, LOG_MAX_SEGMENTS, LOG_SEGMENT_BYTES
+from utils.buffered_writer import BufferedWriter
+from utils.log_records import record_length
+
+
+class SegmentLog:
+    """
+    >>> segments = SegmentLog().load()
+    >>> segments.append(records, buffer)
+    >>> path = segments.oldest()  # None when there's nothing stored
+    >>> segments.pop_oldest()
+    """
+    def __init__(self, directory: str = LOG_DIR, segment_bytes: int = LOG_SEGMENT_BYTES,
+                 max_segments: int = LOG_MAX_SEGMENTS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_segments = max_segments
+        # Segments first..last are on flash, none when first > last
+        self.first = ONE
+        self.last = ZERO
+        self._size = ZERO
+        self.dropped = ZERO
+
+    def __len__(self) -> int:
+        return self.last - self.first + ONE
+
+    def load(self):
+        try:
+            mkdir(self.directory)
+        except OSError:
+            pass
+        ids = [int(name[:-4]) for name in listdir(self.directory) if name.endswith('.bin')]
+        if ids:
+            self.first = min(ids)
+            self.last = max(ids)
+            self._size = stat(self.path(self.last))[6]
+        return self
+
+    def path(self, segment_id: int) -> str:
+        return '{}/{:06d}.bin'.format(self.directory, segment_id)
+
+    def oldest(self) -> Optional[str]:
+        if not len(self):
+            return None
+        return self.path(self.first)
+
+    def pop_oldest(self):
+        if not len(self):
+            return
+        try:
+            remove(self.path(self.first))
+        except OSError:
+            pass
+        self.first += ONE
+
+    def append(self, records, buffer: bytearray = None):
+        """
+        Write whole records, starting new segments (& deleting old ones) as they fill up
+        """
+        records = memoryview(records)
+        n_bytes = len(records)
+        start = ZERO
+        while start < n_bytes:
+            if not len(self) or self._size + record_length(records, start) > self.segment_bytes:
+                self._roll()
+            # As many whole records as fit in the current segment
+            end = start
+            room = self.segment_bytes - self._size
+            while end < n_bytes and end - start + record_length(records, end) <= room:
+                end += record_length(records, end)
+            if end == start:
+                # Bigger than a whole segment, it gets one to itself
+                end += record_length(records, start)
+            with BufferedWriter(self.path(self.last), 'ab', buffer=buffer) as segment:
+                segment.write(records[start:end])
+            self._size += end - start
+            start = end
+
+    def _roll(self):
+        self.last += ONE
+        self._size = ZERO
+        while len(self) > self.max_segments:
+            self.pop_oldest()
+            self.dropped += ONE
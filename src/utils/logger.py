@@ -1,74 +1,258 @@
+"""
+Logging pipeline
+
+`Logger.event`/`log`/`error` pack a binary record (see utils.log_records) into a
+preallocated RAM ring, so logging from the hot path never touches the network or flash.
+`Logger.run` ships the ring to `LOG_URL` in batched POSTs (deflated when the firmware has
+`deflate`) once `LOG_SHIP_BYTES` are waiting, or every `LOG_SHIP_INTERVAL_MS`. Records that
+can't be shipped go to size-capped segment files (see utils.log_segments) & go out ahead
+of newer ones once we're back online.
+"""
+from uasyncio import Event, TimeoutError, create_task, wait_for_ms
+from utime import ticks_add, ticks_diff, ticks_ms, time
+
+import arequests
+from constants import ZERO, ONE
+from settings import (
+    API_URL, FLASH_BLOCK_SIZE, LOG_API_MAX_IN_FLIGHT, LOG_BUFFER_BYTES, LOG_COMPRESS, LOG_ERROR_WAKE_MS,
+    LOG_SHIP_BYTES, LOG_SHIP_INTERVAL_MS, LOG_TIMEOUT_MS, LOG_URL
+)
+from utils.log_records import (
+    CODE_ERROR, CODE_MESSAGE, HEADER_SIZE, LENGTH_OFFSET, LEVEL_ERROR, LEVEL_INFO, MAX_RECORD,
+    pack_record, whole_records
+)
+from utils.log_segments import SegmentLog
+from utils.ring_buffer import ByteRing
+
 try:
-    import urequests as requests
+    from deflate import DeflateIO, ZLIB
+    from io import BytesIO
 except ImportError:
-    import requests
-from constants import API_URL
+    DeflateIO = None
+
+
+# JSON events for the API, each post runs as its own task so the caller never waits on it.
+# At most LOG_API_MAX_IN_FLIGHT at once, so a slow link can't pile up tasks & sockets
+# ##############
+_in_flight = ZERO
 
 
 def log(data, endpoint=''):
-    try:
-        path = endpoint.replace('//', '/')
-        url = ''.join([API_URL, path])
-        req = requests.post(url, json=data)
-        req.close()
-    except Exception as error:
-        log_error(error)
+    path = endpoint.replace('//', '/')
+    url = ''.join([API_URL, path])
+    return _post_task(url, data)
 
 
 def flight_complete():
     url = ''.join([API_URL, '/flight/complete'])
-    try:
-        req = requests.post(url, json={})
-        req.close()
-    except:
-        pass
+    return _post_task(url, {})
 
 
 def log_error(err):
+    logger.error(err)
+
+
+def _post_task(url, data):
+    """
+    :returns Task|None: None if too many posts were in flight already, the event is dropped
+    """
+    global _in_flight
+    if _in_flight >= LOG_API_MAX_IN_FLIGHT:
+        logger.stats['api_dropped'] += ONE
+        return None
+    _in_flight += ONE
+    return create_task(_post(url, data))
+
+
+async def _post(url, data):
+    global _in_flight
     try:
-        with open('error.txt', 'a') as f:
-            f.write(err)
-            f.close()
-    except:
-        pass
-    try:
-        url = ''.join([API_URL, '/error'])
-        req = requests.post(url, json={
-            'error': str(err)
-        })
+        req = await arequests.post(url, json=data, read_timeout_ms=LOG_TIMEOUT_MS)
         req.close()
-    except:
-        pass
+    except Exception as error:
+        log_error(error)
+    finally:
+        _in_flight -= ONE
 
 
 class Logger:
-    def __init__(self, max_logs=3, max_errors=1):
-        self.logs = []
-        self.max_logs = max_logs
-        self.errors = []
-        self.max_errors = max_errors
-
-    def log(self, line):
-        self.logs.append(line)
-        if len(self.logs) > self.max_logs:
-            self.write_logs()
-            self.logs = []
+    """
+    >>> app.start_task(logger.run())
+    >>> logger.log('Photo saved')
+    >>> logger.event(CODE_PHOTO, pack('<IIII', photo_id, ms, baud, heap))
+    >>> logger.error(err)  # Wakes the shipper early while we're online, see LOG_ERROR_WAKE_MS
+    >>> logger.stats  # {'records', 'dropped', 'dropped_segments', 'batches', 'bytes', 'sent_bytes', ...}
+    """
+    def __init__(self, url: str = LOG_URL, segments: SegmentLog = None):
+        self.url = url
+        self.segments = segments if segments is not None else SegmentLog()
+        self.ring = ByteRing(LOG_BUFFER_BYTES, HEADER_SIZE, LENGTH_OFFSET)
+        self._record = bytearray(MAX_RECORD)
+        self._record_view = memoryview(self._record)
+        self._batch = bytearray(LOG_SHIP_BYTES)
+        self._batch_view = memoryview(self._batch)
+        # Only the shipper touches flash, so every write shares this
+        self._file_buffer = bytearray(FLASH_BLOCK_SIZE)
+        # How far into the oldest segment has been shipped, & which segment that was
+        self._segment_offset = ZERO
+        self._offset_segment = ZERO
+        # Optional `WifiManager`, while it's offline records go straight to flash
+        self.wifi = None
+        self.wake = Event()
+        self._error_wake_at = ticks_add(ticks_ms(), -LOG_ERROR_WAKE_MS)
+        self.stats = {
+            'records': ZERO,
+            # Records the ring dropped to make room
+            'dropped': ZERO,
+            # Segments deleted to stay under LOG_MAX_SEGMENTS
+            'dropped_segments': ZERO,
+            'batches': ZERO,
+            'bytes': ZERO,
+            'sent_bytes': ZERO,
+            'spilled': ZERO,
+            'failures': ZERO,
+            # JSON API events dropped because too many were in flight
+            'api_dropped': ZERO,
+        }
+
+    # Hot path
+    # ##############
+    def event(self, code: int, payload=b'', level: int = LEVEL_INFO):
+        count = pack_record(self._record, time(), level, code, payload)
+        self.ring.write(self._record_view[:count])
+        self.stats['records'] += ONE
+        if len(self.ring) >= LOG_SHIP_BYTES:
+            self.wake.set()
         return self
 
+    def log(self, line, level: int = LEVEL_INFO, code: int = CODE_MESSAGE):
+        return self.event(code, str(line).encode(), level)
+
     def error(self, err):
+        self.event(CODE_ERROR, str(err).encode(), LEVEL_ERROR)
+        # Worth shipping early, but offline an early ship is a flash write, & an error
+        # loop would wake it every time
+        now = ticks_ms()
+        if self.is_online() and ticks_diff(now, self._error_wake_at) >= LOG_ERROR_WAKE_MS:
+            self._error_wake_at = now
+            self.wake.set()
+        return self
+
+    def is_online(self) -> bool:
+        return self.wifi is None or self.wifi.is_connected()
+
+    # Shipping
+    # ##############
+    async def run(self):
+        self.segments.load()
+        while True:
+            self.wake.clear()
+            try:
+                await wait_for_ms(self.wake.wait(), LOG_SHIP_INTERVAL_MS)
+            except TimeoutError:
+                pass
+            await self.ship()
+
+    async def ship(self):
+        """
+        Send everything that's waiting (the flash backlog first), or move it to flash if we can't
+        """
+        ring = self.ring
+        if self.is_online() and await self._ship_backlog():
+            while len(ring):
+                # Out of the ring before the post: records logged while it's in flight can push
+                # the oldest out of a full ring, & those mustn't be the ones being sent
+                count = ring.peek_into(self._batch)
+                ring.consume(count)
+                if not await self._post(self._batch_view[:count]):
+                    # Goes on flash ahead of what's still in the ring, so the order holds
+                    self._spill_batch(count)
+                    break
+        if len(ring):
+            self._spill()
+        # Different units: records pushed out of the ring, whole segment files deleted from flash
+        self.stats['dropped'] = ring.dropped
+        self.stats['dropped_segments'] = self.segments.dropped
+
+    async def _post(self, records) -> bool:
+        body = records
+        headers = {'Content-Type': 'application/octet-stream'}
+        if LOG_COMPRESS and DeflateIO is not None:
+            body = compress(records)
+            headers['Content-Encoding'] = 'deflate'
+        stats = self.stats
         try:
-            self.errors.append(err)
-            if len(self.errors) > self.max_errors:
-                self.write_errors()
-                self.errors = []
-        except Exception as fuck:
-            print('Caught an error while trying to log an error...')
-            print(fuck)
-
-    def write_logs(self, file_path='logs.txt'):
-        with open(file_path, 'a') as logs:
-            logs.writelines(self.logs)
-
-    def write_errors(self):
-        with open('error_logs.txt', 'a') as logs:
-            logs.writelines(self.errors)
+            resp = await arequests.post(self.url, data=body, headers=headers, read_timeout_ms=LOG_TIMEOUT_MS)
+            resp.close()
+        except Exception as err:
+            # Whatever went wrong, the shipping task has to survive it
+            print('Log shipping failed', err)
+            stats['failures'] += ONE
+            return False
+        if not 200 <= resp.status_code < 300:
+            stats['failures'] += ONE
+            return False
+        stats['batches'] += ONE
+        stats['bytes'] += len(records)
+        stats['sent_bytes'] += len(body)
+        return True
+
+    # Flash fallback
+    # ##############
+    def _spill(self):
+        """
+        Move everything in the ring onto flash
+        """
+        ring = self.ring
+        while len(ring):
+            count = ring.peek_into(self._batch)
+            self._spill_batch(count)
+            ring.consume(count)
+
+    def _spill_batch(self, count: int):
+        self.segments.append(self._batch_view[:count], self._file_buffer)
+        self.stats['spilled'] += count
+
+    async def _ship_backlog(self) -> bool:
+        """
+        Ship the segments oldest first, each one is deleted once it's all gone out.
+        The offset into the oldest only lives in RAM, so a reboot part way through re-sends some records.
+
+        :returns bool: True once there's no backlog left
+        """
+        segments = self.segments
+        while True:
+            path = segments.oldest()
+            if path is None:
+                return True
+            if segments.first != self._offset_segment:
+                # The segment we were part way through was rotated out since, start this one afresh
+                self._segment_offset = ZERO
+                self._offset_segment = segments.first
+            with open(path, 'rb') as segment:
+                segment.seek(self._segment_offset)
+                while True:
+                    count = segment.readinto(self._batch)
+                    if not count:
+                        break
+                    end = whole_records(self._batch, count)
+                    if not end:
+                        # Truncated by a power cut, nothing more to read in this segment
+                        break
+                    if not await self._post(self._batch_view[:end]):
+                        return False
+                    self._segment_offset += end
+                    segment.seek(self._segment_offset)
+            segments.pop_oldest()
+            self._segment_offset = ZERO
+
+
+def compress(data) -> bytes:
+    stream = BytesIO()
+    with DeflateIO(stream, ZLIB) as deflated:
+        deflated.write(data)
+    return stream.getvalue()
+
+
+# Shared by the whole board
+logger = Logger()
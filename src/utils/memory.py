@@ -0,0 +1,37 @@
+"""
+Heap usage helpers
+"""
+from gc import mem_alloc
+
+
+class HeapMonitor:
+    """
+    MicroPython doesn't track a high-water mark for the heap, so we sample
+    `gc.mem_alloc()` at the points where the most memory is expected to be live.
+
+    >>> heap = HeapMonitor()
+    >>> heap.reset()
+    >>> buf = bytearray(4096)
+    >>> heap.sample()
+    >>> heap.peak_delta()  # ~4096
+    """
+    def __init__(self):
+        self.start = 0
+        self.peak = 0
+
+    def reset(self):
+        self.start = mem_alloc()
+        self.peak = self.start
+        return self
+
+    def sample(self) -> int:
+        allocated = mem_alloc()
+        if allocated > self.peak:
+            self.peak = allocated
+        return allocated
+
+    def peak_delta(self) -> int:
+        """
+        :returns int: Peak bytes allocated since `reset()` was called
+        """
+        return self.peak - self.start
@@ -0,0 +1,84 @@
+"""
+Fixed-size ring of variable-length records
+
+All of the storage is allocated up front. Each record carries its own length in its
+header (a byte at `length_offset`, counting the payload after a `header_size` header).
+When a new record doesn't fit, whole records are dropped off the old end, so the ring
+always holds the most recent ones.
+"""
+from constants import ZERO, ONE
+
+
+class ByteRing:
+    """
+    >>> ring = ByteRing(4096, HEADER_SIZE, LENGTH_OFFSET)
+    >>> ring.write(record)
+    >>> n = ring.peek_into(batch)  # Oldest whole records that fit in `batch`
+    >>> ring.consume(n)            # ... once they've been dealt with
+    """
+    def __init__(self, size: int, header_size: int, length_offset: int):
+        self.buffer = bytearray(size)
+        self._view = memoryview(self.buffer)
+        self.size = size
+        self.header_size = header_size
+        self.length_offset = length_offset
+        self._start = ZERO
+        self.used = ZERO
+        self.dropped = ZERO
+
+    def __len__(self) -> int:
+        return self.used
+
+    def write(self, record) -> int:
+        """
+        Append one whole record
+        """
+        n_bytes = len(record)
+        if n_bytes > self.size:
+            self.dropped += ONE
+            return ZERO
+        while self.size - self.used < n_bytes:
+            self.consume(self._record_length(self._start))
+            self.dropped += ONE
+        end = (self._start + self.used) % self.size
+        first = min(n_bytes, self.size - end)
+        view = self._view
+        view[end:end + first] = record[:first]
+        if first < n_bytes:
+            view[:n_bytes - first] = record[first:]
+        self.used += n_bytes
+        return n_bytes
+
+    def peek_into(self, buf) -> int:
+        """
+        Copy the oldest whole records that fit into `buf`, without removing them
+        :returns int: Bytes copied
+        """
+        n_bytes = ZERO
+        limit = len(buf)
+        while n_bytes < self.used:
+            length = self._record_length((self._start + n_bytes) % self.size)
+            if n_bytes + length > limit:
+                break
+            n_bytes += length
+        if not n_bytes:
+            return ZERO
+        out = memoryview(buf)
+        start = self._start
+        first = min(n_bytes, self.size - start)
+        out[:first] = self._view[start:start + first]
+        if first < n_bytes:
+            out[first:n_bytes] = self._view[:n_bytes - first]
+        return n_bytes
+
+    def consume(self, n_bytes: int):
+        n_bytes = min(n_bytes, self.used)
+        self._start = (self._start + n_bytes) % self.size
+        self.used -= n_bytes
+
+    def clear(self):
+        self._start = ZERO
+        self.used = ZERO
+
+    def _record_length(self, index: int) -> int:
+        return self.header_size + self.buffer[(index + self.length_offset) % self.size]